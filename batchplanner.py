@@ -0,0 +1,292 @@
+'''
+
+Estimate how long a checklist will take before a maintenance window.
+
+A short calibration run on this machine times the same operations the real run
+uses (CSRCreator key generation, CSR signing and PFXCreator load per RSA size,
+PKCS12 export per profile, and small file writes on the output filesystem).
+Export times are scaled by each host's KDF iteration count.  The timings are
+applied to the host list from the checklist to predict the
+serial runtime and the runtime with N parallel workers, and to recommend a
+worker count.
+
+    python batchplanner.py --window 30
+    python batchplanner.py --save calibration.json
+    python batchplanner.py --load calibration.json --source other.xlsx
+
+'''
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import statistics
+import tempfile
+import time
+
+from colorama import Fore, Style
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509.oid import NameOID
+
+from certmanager import CertManager
+from csrcreator import CSRCreator, RSAKeyProvider
+from pfxcreator import PFXCreator, PKCS12_PROFILES, DEFAULT_PKCS12_PROFILE, DEFAULT_EXPORT_FORMATS
+
+CALIBRATION_HOST = 'calibration.local'
+
+
+def _timed(func, *args, **kwargs):
+    # Returns (result, seconds) with the function's console output suppressed
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        return result, time.perf_counter() - start
+
+
+class BatchPlanner:
+    """
+    Calibrates per-operation costs and predicts runtime for a host list.
+    """
+    def __init__(self, key_sizes=(2048, 4096), samples=3, output_dir=None):
+        self.key_sizes = key_sizes
+        self.samples = samples
+        self.output_dir = output_dir or os.getcwd() # Calibrate on the filesystem the real run writes to
+        self.cpu_count = os.cpu_count() or 1
+        self.calibration = {}
+        self.pfxc = PFXCreator() # For the per-host PKCS12 settings and iteration counts
+
+    def calibrate(self):
+        """
+        Times each operation self.samples times and keeps the median.
+        """
+        print(f'{Fore.CYAN}{Style.BRIGHT}Calibrating ({self.samples} samples per operation)...')
+        keygen = {}
+        csr_sign = {}
+        pfx_load = {}
+        export = {p: [] for p in PKCS12_PROFILES}
+        file_write = []
+
+        with tempfile.TemporaryDirectory(dir=self.output_dir) as tmp:
+            csrc = CSRCreator()
+            csrc.HOMEDIR = tmp
+            csrc.csr_data['cn'] = CALIBRATION_HOST
+            pfxc = PFXCreator()
+            materials = {}
+
+            # Key generation, CSR signing and loading all cost more with bigger keys
+            for bits in self.key_sizes:
+                provider = RSAKeyProvider(bits)
+                keygen[bits] = [_timed(provider.get_key, CALIBRATION_HOST)[1] for _ in range(self.samples)]
+
+                csrc.key = provider.get_key(CALIBRATION_HOST)
+                key_path = os.path.join(tmp, f'calibration_{bits}.key')
+                cert_path = os.path.join(tmp, f'calibration_{bits}.cer')
+                with open(key_path, 'wb') as f:
+                    f.write(csrc.key.to_cryptography_key().private_bytes(
+                        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+                with open(cert_path, 'wb') as f:
+                    f.write(self._self_signed(csrc.key.to_cryptography_key()).public_bytes(serialization.Encoding.PEM))
+
+                csr_sign[bits] = []
+                pfx_load[bits] = []
+                for i in range(self.samples):
+                    csrpath = os.path.join(tmp, f'calibration_{bits}_{i}.csr')
+                    csr_sign[bits].append(_timed(csrc.create_csr, csrpath, f'DNS:{CALIBRATION_HOST}')[1])
+                    materials[bits], seconds = _timed(pfxc.load_host_material, CALIBRATION_HOST, cert_path, key_path)
+                    pfx_load[bits].append(seconds)
+
+            # PKCS12 export cost is set by the KDF iterations rather than the key size
+            material = materials[min(self.key_sizes)]
+            for i in range(self.samples):
+                for profile in PKCS12_PROFILES:
+                    data, seconds = _timed(pfxc.export_pkcs12, CALIBRATION_HOST, *material[:3], b'calibration', profile)
+                    export[profile].append(seconds)
+
+            # Small file writes, like the key, CSR and PFX files of a real run.  Synced to disk
+            # so the timing is the filesystem's rather than the page cache's.
+            payload = os.urandom(4096)
+            for i in range(max(self.samples, 20)):
+                start = time.perf_counter()
+                with open(os.path.join(tmp, f'io_{i}.bin'), 'wb') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                file_write.append(time.perf_counter() - start)
+
+        self.calibration = {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'cpu_count': self.cpu_count,
+            'keygen': {str(bits): statistics.median(t) for bits, t in keygen.items()},
+            'csr_sign': {str(bits): statistics.median(t) for bits, t in csr_sign.items()},
+            'pfx_load': {str(bits): statistics.median(t) for bits, t in pfx_load.items()},
+            'pkcs12_export': {p: statistics.median(t) for p, t in export.items()},
+            # KDF iterations each profile was exported with, to scale for other counts
+            'pkcs12_iterations': {p: self.pfxc.pkcs12_iterations(p)[0] for p in PKCS12_PROFILES},
+            'file_write': statistics.median(file_write),
+        }
+        return self.calibration
+
+    def _self_signed(self, key):
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, CALIBRATION_HOST)])
+        now = datetime.datetime.utcnow()
+        return (x509.CertificateBuilder()
+                .subject_name(name).issuer_name(name).public_key(key.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+                .sign(key, hashes.SHA256()))
+
+    def save_calibration(self, path):
+        with open(path, 'w') as f:
+            f.write(json.dumps(self.calibration, indent=2))
+        print(f'{Fore.GREEN}Saved calibration to {path}')
+
+    def load_calibration(self, path):
+        with open(path, 'r') as f:
+            self.calibration = json.loads(f.read())
+        self.cpu_count = self.calibration.get('cpu_count', self.cpu_count)
+        print(f'{Fore.GREEN}Loaded calibration from {path} ({self.calibration.get("timestamp")})')
+        return self.calibration
+
+    @staticmethod
+    def _for_bits(timings, bits, exponent=3):
+        # Calibrated time for a key size.  Uncalibrated sizes are scaled from the nearest one:
+        # RSA generation and signing grow roughly with the cube of the key size
+        if not isinstance(timings, dict):
+            return timings # Calibration saved before timings were kept per key size
+        if str(bits) in timings:
+            return timings[str(bits)]
+        nearest = min(timings, key=lambda b: abs(int(b) - bits))
+        return timings[nearest] * (bits / int(nearest)) ** exponent
+
+    def host_cost(self, host, bits=4096, profile=DEFAULT_PKCS12_PROFILE, formats=DEFAULT_EXPORT_FORMATS,
+                  iterations=None):
+        """
+        Predicted (cpu_seconds, io_seconds) for one host's CSR and PFX phases.
+        Per-host pkcs12_profile, pkcs12_kdf_iterations and export_formats from the
+        checklist win over the batch values.
+        """
+        c = self.calibration
+        keygen = self._for_bits(c['keygen'], bits)
+        csr_sign = self._for_bits(c['csr_sign'], bits)
+        pfx_load = self._for_bits(c['pfx_load'], bits, exponent=1)
+        with contextlib.redirect_stdout(io.StringIO()): # Invalid per-host iterations are warned about in the real run
+            profile, iterations = self.pfxc.host_pkcs12_settings(host, profile, iterations)
+        if profile not in c['pkcs12_export']:
+            profile = DEFAULT_PKCS12_PROFILE
+        formats = host.get('export_formats') or formats
+        if isinstance(formats, str):
+            formats = formats.split(',')
+        formats = [f.strip().lower() for f in formats if f.strip()]
+        # Export time grows linearly with the KDF iteration count
+        calibrated = c.get('pkcs12_iterations', {}).get(profile) or PKCS12_PROFILES[profile]['iterations']
+        export = c['pkcs12_export'][profile] * self.pfxc.pkcs12_iterations(profile, iterations)[0] / calibrated
+
+        cpu = keygen + csr_sign + pfx_load + (export if 'pkcs12' in formats else 0)
+        # Directory, key and CSR, then one file per output format
+        io_ops = 3 + len(formats)
+        return cpu, io_ops * c['file_write']
+
+    def estimate(self, host_list, bits=4096, profile=DEFAULT_PKCS12_PROFILE, formats=DEFAULT_EXPORT_FORMATS,
+                 max_workers=None, iterations=None):
+        """
+        Predicts serial and parallel runtime for the host list.
+
+        CPU work is assumed to scale up to the calibrated CPU count and file writes with
+        the worker count.  No run can be shorter than its slowest host.
+        """
+        costs = [self.host_cost(h, bits, profile, formats, iterations) for h in host_list if h.get('hostname')]
+        if not costs:
+            return None
+        cpu_total = sum(c for c, _ in costs)
+        io_total = sum(i for _, i in costs)
+        longest = max(c + i for c, i in costs)
+
+        max_workers = max_workers or max(len(costs), 1)
+        parallel = {}
+        for w in range(1, max_workers + 1):
+            parallel[w] = max(longest, cpu_total / min(w, self.cpu_count) + io_total / w)
+
+        best = min(parallel.values())
+        # Smallest worker count within 5% of the best prediction
+        recommended = min(w for w, t in parallel.items() if t <= best * 1.05)
+        return {
+            'hosts': len(costs),
+            'cpu_seconds': cpu_total,
+            'io_seconds': io_total,
+            'serial_seconds': cpu_total + io_total,
+            'parallel_seconds': parallel,
+            'recommended_workers': recommended,
+        }
+
+    def report(self, estimate, window_minutes=None):
+        c = self.calibration
+        print(f'\n{Fore.CYAN}{Style.BRIGHT}Calibration ({c["cpu_count"]} CPUs):')
+        for bits, t in c['keygen'].items():
+            print("{:<28}{:>12.1f} ms".format(f'RSA {bits} key generation', t * 1000))
+        for bits in c['keygen']:
+            print("{:<28}{:>12.1f} ms".format(f'RSA {bits} CSR signing', self._for_bits(c['csr_sign'], int(bits)) * 1000))
+            print("{:<28}{:>12.1f} ms".format(f'RSA {bits} key/cert load', self._for_bits(c['pfx_load'], int(bits), 1) * 1000))
+        for profile, t in c['pkcs12_export'].items():
+            iterations = c.get('pkcs12_iterations', {}).get(profile) or PKCS12_PROFILES[profile]['iterations']
+            print("{:<28}{:>12.1f} ms".format(f'PKCS12 export {profile}', t * 1000) + f'  ({iterations} iterations)')
+        print("{:<28}{:>12.2f} ms".format('Small file write', c['file_write'] * 1000))
+
+        if estimate is None:
+            print(f'{Fore.RED}No hosts to estimate.')
+            return
+        print(f'\n{Fore.CYAN}{Style.BRIGHT}Prediction for {estimate["hosts"]} hosts:')
+        print("{:<28}{:>12}".format('serial', self._duration(estimate['serial_seconds'])))
+        shown = sorted({w for w in (2, 4, 8, 16, self.cpu_count, estimate['recommended_workers']) if w > 1
+                        and w in estimate['parallel_seconds']})
+        for w in shown:
+            print("{:<28}{:>12}".format(f'{w} workers', self._duration(estimate['parallel_seconds'][w])))
+        rec = estimate['recommended_workers']
+        print(f'{Fore.GREEN}{Style.BRIGHT}Recommended workers: {rec} '
+              f'({self._duration(estimate["parallel_seconds"][rec])})')
+
+        if window_minutes:
+            window = window_minutes * 60
+            runs = [('Serial', estimate['serial_seconds'])]
+            if rec > 1:
+                runs.append((f'{rec} worker', estimate['parallel_seconds'][rec]))
+            for label, seconds in runs:
+                fits = seconds <= window
+                colour = Fore.GREEN if fits else Fore.RED
+                print(f'{colour}{label} run {"fits" if fits else "does NOT fit"} in the {window_minutes} minute window.')
+
+    @staticmethod
+    def _duration(seconds):
+        return str(datetime.timedelta(seconds=math.ceil(seconds)))
+
+
+if __name__ == '__main__':
+    cm = CertManager()
+    parser = argparse.ArgumentParser(description='Predict runtime for a certificate checklist.')
+    parser.add_argument('--source', default=cm.SOURCE_XML_FILE, help='Checklist spreadsheet')
+    parser.add_argument('--bits', type=int, default=RSAKeyProvider().bits, help='RSA key size for the run')
+    parser.add_argument('--key-sizes', default='2048,4096', help='RSA key sizes to calibrate, comma separated')
+    parser.add_argument('--profile', default=DEFAULT_PKCS12_PROFILE, choices=list(PKCS12_PROFILES))
+    parser.add_argument('--iterations', type=int, help='Batch PKCS12 KDF iteration override, as in the real run')
+    parser.add_argument('--formats', default=','.join(DEFAULT_EXPORT_FORMATS), help='Batch export formats')
+    parser.add_argument('--samples', type=int, default=3, help='Calibration samples per operation')
+    parser.add_argument('--window', type=float, help='Maintenance window in minutes')
+    parser.add_argument('--save', help='Save the calibration to this json file')
+    parser.add_argument('--load', help='Use a saved calibration instead of calibrating')
+    args = parser.parse_args()
+
+    cm.get_host_list(args.source)
+    planner = BatchPlanner([int(b) for b in args.key_sizes.split(',')], args.samples)
+    if args.load:
+        planner.load_calibration(args.load)
+    else:
+        planner.calibrate()
+    if args.save:
+        planner.save_calibration(args.save)
+
+    estimate = planner.estimate(cm.HOST_LIST, args.bits, args.profile, args.formats.split(','),
+                                iterations=args.iterations)
+    planner.report(estimate, args.window)
@@ -10,12 +10,14 @@ Certificates must be signed in Base64 format.
 
 '''
 
-from pfxcreator import PFXCreator
+from pfxcreator import PFXCreator, PKCS12_PROFILES, DEFAULT_PKCS12_PROFILE, EXPORT_FORMATS, DEFAULT_EXPORT_FORMATS
 from csrcreator import CSRCreator
+from profiler import PROFILER, DUMP_FORMATS
 from colorama import Fore, Style, Back
 import openpyxl
 import os
 import json
+import argparse
 
 class CertManager():
 
@@ -23,6 +25,12 @@ class CertManager():
         self.HOST_LIST = [] # List of hosts that require identity certificates
         self.CERT_LIST = [] # An array of dictionaries with directory and file info for the CSR's and key files
         self.SOURCE_XML_FILE = 'SNA Certificate Checklist.xlsx'
+        # Optional checklist columns, found by their header text in row 1, mapped to host keys
+        self.OPTIONAL_COLUMNS = {
+            'PKCS12 Profile': 'pkcs12_profile',
+            'PKCS12 Iterations': 'pkcs12_kdf_iterations',
+            'Export Formats': 'export_formats',
+        }
 
     def get_host_list(self, source_file):
         # XLSX checklist file.  Column A must have hostlist in it.
@@ -31,6 +39,11 @@ class CertManager():
         first_sheet = wb.get_sheet_names()[0]
         worksheet = wb.get_sheet_by_name(first_sheet)
 
+        optional_columns = {}
+        for cell in worksheet[1]:
+            if cell.value in self.OPTIONAL_COLUMNS:
+                optional_columns[self.OPTIONAL_COLUMNS[cell.value]] = cell.column_letter
+
         for row in range(2,worksheet.max_row+1): # first varible is the start row. 2 is to avoid the header
             host_dict = {}
             for column in "AB": # add or reduce columns - Just looking in column A
@@ -42,6 +55,8 @@ class CertManager():
                     c = worksheet[cell_name].value
                     ip_dict = {'ip': c}
                     host_dict.update(ip_dict)
+                    for key, col in optional_columns.items():
+                        host_dict[key] = worksheet["{}{}".format(col, row)].value
                     self.HOST_LIST.append(host_dict)
 
 
@@ -135,15 +150,20 @@ def set_source_spreadsheet():
 
 
 def generate_csrs():
+    PROFILER.begin_run('csr')
     cm.get_host_list(cm.SOURCE_XML_FILE)
     csrc.set_host_list(cm.HOST_LIST)
     csrc.csr_hosts()
     csrc.output_csr_list()
+    PROFILER.end_run()
     return
 
 
 def create_pkcs12s():
     # invoke pfxcreator.py object to create our pkcs12 certificates
+    if csrc.dry_run:
+        print(f'{Fore.YELLOW}[dry run] PKCS12 creation is skipped in a dry run.')
+        return
     
     # TAGGED FOR DELETION
     '''
@@ -153,9 +173,34 @@ def create_pkcs12s():
     cl = pfxc.read_cert_list_file(source_file)
     '''
     pfxc.cert_list_data = pfxc.read_cert_list_file(pfxc.find_cert_list_file())
+    # Batch PKCS12 profile.  Hosts with a PKCS12 Profile in the checklist keep their own.
+    print(f'{Fore.CYAN}PKCS12 profiles:')
+    for name, settings in PKCS12_PROFILES.items():
+        mac = 'MAC iterations follow the KDF count' if settings['mac_configurable'] else f'MAC iterations fixed at {settings["mac_iterations"]}'
+        print("{: >16}  {} (KDF iterations {}, {})".format(name, settings['description'], settings['iterations'], mac))
+    while True:
+        profile = input(f'PKCS12 profile [{DEFAULT_PKCS12_PROFILE}]: ').strip() or DEFAULT_PKCS12_PROFILE
+        if profile in PKCS12_PROFILES:
+            break
+        print(f'{Fore.RED}Unknown profile {profile}.  Enter one of {", ".join(PKCS12_PROFILES)}')
+    # Optional KDF iteration override.  Hosts with PKCS12 Iterations in the checklist keep their own.
+    while True:
+        iterations = input('PKCS12 KDF iterations [profile default]: ').strip()
+        if not iterations:
+            iterations = None
+            break
+        if iterations.isdigit() and int(iterations) > 0:
+            iterations = int(iterations)
+            break
+        print(f'{Fore.RED}Enter a whole number greater than 0, or leave blank.')
+    # Batch export formats.  Hosts with Export Formats in the checklist keep their own.
+    formats = input(f'Export formats, comma separated ({", ".join(EXPORT_FORMATS)}) [{",".join(DEFAULT_EXPORT_FORMATS)}]: ').strip()
+    formats = formats.split(',') if formats else DEFAULT_EXPORT_FORMATS
     # For updated pfxcreator.py 2.0
     # The function now expects a passphrase.
-    pfxc.process_all_certs('Password123')
+    PROFILER.begin_run('pkcs12')
+    pfxc.process_all_certs('Password123', profile=profile, iterations=iterations, formats=formats)
+    PROFILER.end_run()
     #TAGGED FOR DELETION
     '''
     # start parsing json and creating certs
@@ -203,10 +248,25 @@ if __name__ == '__main__':
     '''
     # os.chdir('CSRcreator')
 
+    parser = argparse.ArgumentParser(description='Batch create CSR\'s and PKCS12 files.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Plan directories, keys, CSRs and the csr list without generating keys or writing host files')
+    # Named --profiling so it isn't confused with the PKCS12 --profile of the other scripts
+    parser.add_argument('--profiling', action='store_true',
+                        help='Time the hot paths and report the slowest hosts and phases after each run')
+    parser.add_argument('--profiling-dump', choices=DUMP_FORMATS,
+                        help='Also write a cProfile or collapsed-stack file for each run (implies --profiling)')
+    args = parser.parse_args()
+
+    if args.profiling or args.profiling_dump:
+        PROFILER.enable(dump=args.profiling_dump)
 
     cm = CertManager()
     csrc = CSRCreator()
     pfxc = PFXCreator()
+    if args.dry_run:
+        csrc.set_dry_run()
+        print(f'{Fore.YELLOW}{Style.BRIGHT}Dry run - no keys will be generated and no host files written.')
    
     # RESTORE THIS SECTION
     #os.chdir('CSRCreator')
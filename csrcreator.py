@@ -11,12 +11,63 @@ import os, datetime
 import colorama
 from colorama import Fore, Style
 import json
+import hashlib
+from abc import ABC, abstractmethod
+from profiler import PROFILER, profiled
 
 
 colorama.init(autoreset=True)
 now = datetime.datetime.now()
 d = now.date()
 
+# Bundled test keys for FixtureKeyProvider
+FIXTURE_KEY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'keys')
+
+
+class KeyProvider(ABC):
+    '''
+    Supplies the private key for each CSR.  Subclass and implement get_key()
+    to change where keys come from.
+    '''
+
+    @abstractmethod
+    def get_key(self, hostname):
+        # Return a crypto.PKey for the host
+        pass
+
+
+class RSAKeyProvider(KeyProvider):
+    # Generates a new RSA key for every host.  This is the default.
+
+    def __init__(self, bits=4096):
+        self.bits = bits
+
+    def get_key(self, hostname):
+        key = crypto.PKey()
+        key.generate_key(crypto.TYPE_RSA, self.bits)
+        return key
+
+
+class FixtureKeyProvider(KeyProvider):
+    '''
+    Serves pre-generated keys from a directory of PEM .key files, so tests don't
+    pay for RSA generation.  The same hostname always gets the same key.
+    '''
+
+    def __init__(self, key_dir=FIXTURE_KEY_DIR):
+        self.keys = []
+        for f in sorted(os.listdir(key_dir)):
+            if f.endswith('.key'):
+                with open(os.path.join(key_dir, f), 'rb') as keyfile:
+                    self.keys.append(crypto.load_privatekey(crypto.FILETYPE_PEM, keyfile.read()))
+        if not self.keys:
+            raise ValueError(f'No .key files found in {key_dir}')
+
+    def get_key(self, hostname):
+        index = int(hashlib.sha256(str(hostname).encode('utf-8')).hexdigest(), 16) % len(self.keys)
+        return self.keys[index]
+
+
 class CSRCreator():
 
     def __init__(self):
@@ -39,6 +90,11 @@ class CSRCreator():
         # Home directory is wherever the script lives.  Feel free to change
         self.HOMEDIR = os.getcwd() 
         self.key = crypto.PKey() 
+        # Where keys come from.  See set_key_provider()
+        self.key_provider = RSAKeyProvider()
+        # Dry run plans directories, keys, CSRs and the csr list without generating keys
+        # or writing anything other than a dryrun_csr_list json
+        self.dry_run = False
 
 
     def set_host_list(self, host_list):
@@ -55,9 +111,20 @@ class CSRCreator():
     def set_cert_data(self, csr_json):
         self.CERT_LIST = csr_json
 
+    def set_key_provider(self, provider):
+        # Takes a KeyProvider used by generatekey()
+        self.key_provider = provider
+
+    def set_dry_run(self, dry_run=True):
+        self.dry_run = dry_run
+
     
 
+    @profiled('create_dir')
     def create_dir(self, name):
+        if self.dry_run:
+            print(f'{Fore.YELLOW}[dry run] Would create directory {name}')
+            return
         try:
             if name is not None:
                 print(f'{Fore.GREEN}{Style.BRIGHT} Creating directory {name}')
@@ -73,14 +140,19 @@ class CSRCreator():
             quit()
 
 
-    def generatekey(self, keypath):
+    @profiled('generatekey')
+    def generatekey(self, keypath, hostname=None):
+        if self.dry_run:
+            print(f'{Fore.YELLOW}[dry run] Would write key file {keypath}')
+            return
         if os.path.exists(keypath):
             print(f"{Fore.RED}{Style.BRIGHT} ** Certificate file exists, aborting ** ")
             print(keypath)
         # else write the key file
         else:
             print(f"{Fore.BLUE} \n- Generating key file...\n")
-            self.key.generate_key(crypto.TYPE_RSA, 4096)
+            with PROFILER.span('keygen'):
+                self.key = self.key_provider.get_key(hostname)
             f = open(keypath, "w")
 
             keydump = crypto.dump_privatekey(crypto.FILETYPE_PEM, self.key)
@@ -89,6 +161,7 @@ class CSRCreator():
             f.close()
             print(f'{Fore.GREEN}{Style.BRIGHT} - Keyfile Generated! {Fore.CYAN}{keypath}')
 
+    @profiled('create_csr')
     def create_csr(self, csrpath, subjectAltName):
         req = crypto.X509Req()
         req.get_subject().CN = self.csr_data['cn']
@@ -103,6 +176,14 @@ class CSRCreator():
             b'subjectAltName', False,
             subjectAltName.encode('ascii'))])
 
+        if self.dry_run:
+            # No key in a dry run, so stop before signing
+            subject = ', '.join(f'{k.decode()}={v.decode()}' for k, v in req.get_subject().get_components())
+            print(f'{Fore.YELLOW}[dry run] Would write CSR {csrpath}')
+            print(f'{Fore.YELLOW}[dry run]   Subject: {subject}')
+            print(f'{Fore.YELLOW}[dry run]   SAN: {subjectAltName}')
+            return subject
+
         req.set_pubkey(self.key)
         req.sign(self.key, "sha256")
     
@@ -123,23 +204,36 @@ class CSRCreator():
             print(f"CSR Created: {csrpath}")
         return
 
-    def cert_request(self, hostname, subjectAltName):
+    def cert_request(self, hostname, subjectAltName, host_options=None):
+        # host_options holds optional per-host checklist settings (e.g. pkcs12_profile)
+        # which are carried into the csr_list json for pfxcreator.py
         # create new dir
         if hostname is not None:
-            os.chdir(self.HOMEDIR)
-            print(os.getcwd())
-            self.create_dir(hostname)
-            os.chdir(hostname)
-            keypath = os.getcwd() + '/' + hostname + '_' + str(d) + '.key'
-            print(f'Keypath is: {keypath}')
+            with PROFILER.host(hostname), PROFILER.span('cert_request'):
+                os.chdir(self.HOMEDIR)
+                print(os.getcwd())
+                self.create_dir(hostname)
+                if self.dry_run:
+                    # The host directory isn't created in a dry run, so don't change into it
+                    host_dir = os.path.join(self.HOMEDIR, hostname)
+                else:
+                    os.chdir(hostname)
+                    host_dir = os.getcwd()
+                keypath = host_dir + '/' + hostname + '_' + str(d) + '.key'
+                print(f'Keypath is: {keypath}')
     
-            # Generate Key
-            self.generatekey(keypath)
+                # Generate Key
+                self.generatekey(keypath, hostname)
     
-            # Create CSR
-            csrpath = os.getcwd() + '/' + hostname + '_' + str(d) + '.csr'
-            self.create_csr(csrpath, subjectAltName)
-            self.CERT_LIST.append({'hostname': hostname, 'keyfile': keypath, 'csrfile': csrpath})
+                # Create CSR
+                csrpath = host_dir + '/' + hostname + '_' + str(d) + '.csr'
+                subject = self.create_csr(csrpath, subjectAltName)
+                cert_entry = {'hostname': hostname, 'keyfile': keypath, 'csrfile': csrpath}
+                if self.dry_run:
+                    cert_entry.update({'dry_run': True, 'subject': subject, 'subjectAltName': subjectAltName})
+                if host_options:
+                    cert_entry.update({k: v for k, v in host_options.items() if v is not None})
+                self.CERT_LIST.append(cert_entry)
         else:
             return
 
@@ -155,18 +249,19 @@ class CSRCreator():
             # SAN2 is the IP address of the appliance
             self.csr_data['cn'] = h['hostname']
             san1 = h['hostname']
+            host_options = {k: v for k, v in h.items() if k not in ('hostname', 'ip')}
 
             if h['ip'] is not None:
                 # If IP address is present in file, 
                 san2 = h['ip']
                 subjectAltName = f'DNS:{san1},IP:{san2}'
 
-                self.cert_request(h['hostname'], subjectAltName)
+                self.cert_request(h['hostname'], subjectAltName, host_options)
 
             else:
                 # If ip address field is blank, don't include second SAN
                 subjectAltName = f'DNS:{san1}'
-                self.cert_request(h['hostname'], subjectAltName)
+                self.cert_request(h['hostname'], subjectAltName, host_options)
                     
         return
 
@@ -175,9 +270,14 @@ class CSRCreator():
         try:
             os.chdir(self.HOMEDIR)
             csr_json_file = 'csr_list_' + str(d) + '.json'
+            if self.dry_run:
+                # Not named csr_list* so pfxcreator.py won't pick it up
+                csr_json_file = 'dryrun_' + csr_json_file
             csr_json_data  = json.dumps(self.CERT_LIST)
             with open(csr_json_file, 'w') as csrfile:
                 csrfile.write(csr_json_data)
+            if self.dry_run:
+                print(f'{Fore.YELLOW}[dry run] Wrote planned csr list to {csr_json_file}')
             return
         except Exception as e:
             print(f'Error creating CSR list json file.  Quitting. \n{e}')
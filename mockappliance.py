@@ -0,0 +1,106 @@
+'''
+
+A local stand-in for the appliance API used by pfxdeployer.py, so deployments
+can be tried offline.
+
+It accepts a form login on the login path and a multipart PKCS12 upload on the
+upload path, checks that the PKCS12 opens with the supplied password, and keeps
+a record of every upload.  fail_first makes the first N uploads for each host
+return 503 to exercise retries.
+
+    python mockappliance.py --port 8080
+    python pfxdeployer.py --scheme http --port 8080 --address-override 127.0.0.1
+
+'''
+
+import argparse
+import secrets
+
+from aiohttp import web
+from colorama import Fore
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+from pfxdeployer import DEFAULT_LOGIN_PATH, DEFAULT_UPLOAD_PATH
+
+SESSION_COOKIE = 'stealthwatch.jwt'
+
+
+class MockAppliance:
+    """
+    Minimal appliance API built on aiohttp.web.
+    """
+    def __init__(self, username='admin', password='admin', host='127.0.0.1', port=8080,
+                 login_path=DEFAULT_LOGIN_PATH, upload_path=DEFAULT_UPLOAD_PATH, fail_first=0):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.fail_first = fail_first
+        self.tokens = set()
+        self.attempts = {} # hostname -> upload attempts seen
+        self.uploads = [] # dicts with hostname, filename, subject and size of each accepted upload
+        self.app = web.Application()
+        self.app.router.add_post(login_path, self.login)
+        self.app.router.add_post(upload_path, self.upload)
+        self._runner = None
+
+    async def login(self, request):
+        form = await request.post()
+        if form.get('username') != self.username or form.get('password') != self.password:
+            return web.json_response({'error': 'Invalid credentials'}, status=401)
+        token = secrets.token_hex(16)
+        self.tokens.add(token)
+        resp = web.json_response({'status': 'ok'})
+        resp.set_cookie(SESSION_COOKIE, token)
+        return resp
+
+    async def upload(self, request):
+        if request.cookies.get(SESSION_COOKIE) not in self.tokens:
+            return web.json_response({'error': 'Not authenticated'}, status=401)
+        form = await request.post()
+        hostname = form.get('hostname')
+        self.attempts[hostname] = self.attempts.get(hostname, 0) + 1
+        if self.attempts[hostname] <= self.fail_first:
+            return web.json_response({'error': 'Service unavailable'}, status=503)
+
+        upload = form.get('file')
+        if upload is None:
+            return web.json_response({'error': 'No file'}, status=400)
+        data = upload.file.read()
+        try:
+            key, cert, cas = pkcs12.load_key_and_certificates(data, form.get('password', '').encode('utf-8'))
+        except ValueError as e:
+            return web.json_response({'error': f'Could not open PKCS12: {e}'}, status=400)
+        if cert is None or key is None:
+            return web.json_response({'error': 'PKCS12 has no certificate or key'}, status=400)
+
+        self.uploads.append({
+            'hostname': hostname,
+            'filename': upload.filename,
+            'subject': cert.subject.rfc4514_string(),
+            'size': len(data),
+        })
+        return web.json_response({'status': 'ok'}, status=201)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a mock appliance API for pfxdeployer.py.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--fail-first', type=int, default=0, help='Return 503 for the first N uploads per host')
+    args = parser.parse_args()
+
+    mock = MockAppliance(args.username, args.password, args.host, args.port, fail_first=args.fail_first)
+    print(f'{Fore.CYAN}Mock appliance API on http://{args.host}:{args.port}')
+    web.run_app(mock.app, host=args.host, port=args.port)
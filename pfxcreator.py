@@ -3,6 +3,10 @@ import os
 import json
 import re # Added for parsing multiple PEM blocks
 import getpass # Added for secure passphrase input
+import time # Added for per-profile export timing
+import hashlib # Added for PFX input hashes
+import hmac
+from profiler import PROFILER, profiled # Opt-in timing spans
 
 # Using colorama for colored output
 from colorama import Style, Back, Fore
@@ -16,6 +20,63 @@ from OpenSSL.crypto import (
     load_privatekey,
     Error as OpenSSLError # Specific OpenSSL error type
 )
+# cryptography is installed alongside pyOpenSSL and lets us pick the PKCS12 algorithms
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization import (
+    BestAvailableEncryption,
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    pkcs12
+)
+
+# Named PKCS12 encryption profiles.
+# 'default' keeps the pyOpenSSL PKCS12.export() behaviour. The others choose the
+# key/cert encryption and MAC algorithms explicitly.
+# 'iterations' is the KDF iteration count and can be overridden per batch or host.
+# 'mac_iterations' is the MAC iteration count.  Only 'default' lets an iteration
+# override set it too ('mac_configurable'); cryptography always uses 1 for the others.
+PKCS12_PROFILES = {
+    'default': {
+        'description': 'pyOpenSSL library defaults',
+        'key_cert_algorithm': None,
+        'hmac_hash': None,
+        'iterations': 2048,
+        'mac_iterations': 1,
+        'mac_configurable': True,
+    },
+    'legacy-3des': {
+        'description': 'PBES1 SHA1/3DES with SHA1 MAC - for older appliances',
+        'key_cert_algorithm': pkcs12.PBES.PBESv1SHA1And3KeyTripleDESCBC,
+        'hmac_hash': hashes.SHA1(),
+        'iterations': 2048,
+        'mac_iterations': 1,
+        'mac_configurable': False,
+    },
+    'modern-aes256': {
+        'description': 'PBES2 PBKDF2-SHA256/AES-256-CBC with SHA256 MAC',
+        'key_cert_algorithm': pkcs12.PBES.PBESv2SHA256AndAES256CBC,
+        'hmac_hash': hashes.SHA256(),
+        'iterations': 50000,
+        'mac_iterations': 1,
+        'mac_configurable': False,
+    },
+}
+DEFAULT_PKCS12_PROFILE = 'default'
+
+# Output formats that can be written from one load of a host's key, cert and chain.
+# Values are the suffix appended to <host>_<date>.
+EXPORT_FORMATS = {
+    'pkcs12': '.pfx', # PKCS12 using the selected profile
+    'pem': '.pem', # Certificate followed by the unencrypted private key
+    'fullchain': '_fullchain.pem', # Certificate followed by the CA chain
+    'der': '.der', # Certificate only, DER encoded
+    'pkcs8': '_pkcs8.key', # Private key as PKCS8 PEM, encrypted with the passphrase
+}
+DEFAULT_EXPORT_FORMATS = ('pkcs12',)
+# Keys process_cert records on a csr_list entry.  Cleared before every build.
+PKCS12_RESULT_KEYS = ('outputs', 'pfxfile', 'pkcs12_profile_used', 'pkcs12_iterations',
+                      'pkcs12_mac_iterations', 'pkcs12_export_ms', 'pkcs12_input_hash')
 
 class PFXCreator:
     """
@@ -27,6 +88,8 @@ class PFXCreator:
         self.HOME_DIR = os.getcwd()
         self.cert_list_data = [] # Renamed for clarity and consistency
         self.today_date = datetime.datetime.now().date() # Renamed for clarity
+        self.cert_list_file = None # Path of the loaded csr_list json so results can be written back
+        self.export_timings = [] # One dict per PKCS12 export: hostname, profile, seconds
 
     def set_cert_list(self, certlist):
         """
@@ -60,6 +123,7 @@ class PFXCreator:
         try:
             with open(fn, 'r', encoding='utf-8') as file:
                 self.cert_list_data = json.loads(file.read())
+            self.cert_list_file = fn
             print(f'{Fore.GREEN}Successfully loaded certificate list from {fn}')
             return self.cert_list_data
         except FileNotFoundError:
@@ -72,6 +136,21 @@ class PFXCreator:
             print(f'{Fore.RED}Error reading certificate list file {fn}: {e}')
             return None
 
+    def write_cert_list_file(self):
+        """
+        Writes self.cert_list_data back to the csr_list JSON it was loaded from,
+        so per-host results (such as the PKCS12 profile used) are kept in the manifest.
+        """
+        if not self.cert_list_file:
+            return False
+        try:
+            with open(self.cert_list_file, 'w', encoding='utf-8') as file:
+                file.write(json.dumps(self.cert_list_data))
+            return True
+        except Exception as e:
+            print(f'{Fore.RED}Error writing certificate list file {self.cert_list_file}: {e}')
+            return False
+
     def _read_file_as_bytes(self, filepath):
         """
         Helper method to read a file's content as bytes.
@@ -87,20 +166,23 @@ class PFXCreator:
             print(f'{Fore.RED}Error reading file {filepath} as bytes: {e}')
             return None
 
-    def _load_pem_certificates_from_file(self, filepath):
+    @profiled('_load_pem_certificates_from_file')
+    def _load_pem_certificates_from_file(self, filepath, content=None):
         """
         Reads a file that may contain one or more concatenated PEM certificates
         and returns a list of OpenSSL.crypto.X509 objects.
+        Pass content (str) if the file has already been read.
         Returns an empty list if the file is not found, empty, or contains no valid certs.
         """
         certs = []
-        if not filepath or not os.path.exists(filepath):
+        if content is None and (not filepath or not os.path.exists(filepath)):
             # print(f'{Fore.YELLOW}Warning: CA chain file not found or path is empty: {filepath}')
             return [] # Return empty list if file doesn't exist or path is invalid
 
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            if content is None:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    content = f.read()
 
             # Regular expression to find all PEM certificate blocks
             # re.DOTALL ensures '.' matches newlines
@@ -126,7 +208,9 @@ class PFXCreator:
             print(f'{Fore.RED}Error loading CA certificates from {filepath}: {e}')
             return []
 
-    def generate_pkcs12(self, host, cert_filepath, pkey_filepath, passphrase, ca_chain_filepath=None):
+    @profiled('generate_pkcs12')
+    def generate_pkcs12(self, host, cert_filepath, pkey_filepath, passphrase, ca_chain_filepath=None,
+                        profile=DEFAULT_PKCS12_PROFILE, iterations=None):
         """
         Generates a PKCS12 (.pfx) file from a signed certificate, private key,
         and an optional CA certificate chain.
@@ -138,17 +222,32 @@ class PFXCreator:
             passphrase (bytes): The passphrase to encrypt the PKCS12 file.
             ca_chain_filepath (str, optional): Full path to a file containing
                                                concatenated CA/intermediate certificates.
+            profile (str, optional): Name of a PKCS12_PROFILES entry.
+            iterations (int, optional): Overrides the profile's KDF iteration count
+                                        (and the MAC count where the profile allows it).
 
         Returns:
             bytes: The binary content of the PKCS12 file, or None on failure.
         """
+        if profile not in PKCS12_PROFILES:
+            print(f'{Fore.RED}Unknown PKCS12 profile "{profile}" for {host}. Available: {", ".join(PKCS12_PROFILES)}')
+            return None
+        material = self.load_host_material(host, cert_filepath, pkey_filepath, ca_chain_filepath)
+        if material is None:
+            return None
+        cert, pkey, ca_certs, _ = material
+        return self.export_pkcs12(host, cert, pkey, ca_certs, passphrase, profile, iterations)
+
+    @profiled('load_host_material')
+    def load_host_material(self, host, cert_filepath, pkey_filepath, ca_chain_filepath=None):
+        """
+        Reads and parses a host's certificate, private key and optional CA chain once.
+        Returns (cert, pkey, ca_certs, inputs), or None on failure.  cert, pkey and
+        ca_certs are pyOpenSSL objects.  inputs holds the bytes they were loaded from
+        under 'cert', 'key' and 'ca_chain', for input_hash().
+        """
         friendly_name = f'{host}.pfx'
         try:
-            if not self.validate_base64_cert(cert_filepath):
-                print(f'{Fore.RED}{Style.BRIGHT}Unable to create PKCS12 for {friendly_name} - Host certificate not valid Base64 PEM.')
-                return None
-
-            p12 = PKCS12()
             pem_bytes = self._read_file_as_bytes(cert_filepath)
             pkey_bytes = self._read_file_as_bytes(pkey_filepath)
 
@@ -156,29 +255,178 @@ class PFXCreator:
                 print(f'{Fore.RED}Failed to read host certificate or private key files for {host}.')
                 return None
 
-            p12.set_certificate(load_certificate(FILETYPE_PEM, pem_bytes))
-            p12.set_privatekey(load_privatekey(FILETYPE_PEM, pkey_bytes))
+            cert = self.validate_base64_cert(cert_filepath, pem_bytes)
+            if cert is None:
+                print(f'{Fore.RED}{Style.BRIGHT}Unable to create PKCS12 for {friendly_name} - Host certificate not valid Base64 PEM.')
+                return None
+
+            pkey = load_privatekey(FILETYPE_PEM, pkey_bytes)
 
             # --- NEW: Add CA certificates to the PKCS12 object if provided ---
+            ca_certs = []
+            ca_bytes = None
             if ca_chain_filepath:
-                ca_certs = self._load_pem_certificates_from_file(ca_chain_filepath)
+                ca_bytes = self._read_file_as_bytes(ca_chain_filepath)
+                if ca_bytes is not None:
+                    ca_certs = self._load_pem_certificates_from_file(ca_chain_filepath, ca_bytes.decode('utf-8'))
                 if ca_certs:
-                    p12.set_ca_certificates(ca_certs)
                     print(f'{Fore.CYAN} -- Added {len(ca_certs)} CA certificates from {ca_chain_filepath} to {friendly_name}')
                 else:
                     print(f'{Fore.YELLOW}Warning: No valid CA certificates loaded from {ca_chain_filepath} for {host}. PKCS12 will be created without a CA chain.')
             # --- END NEW ---
 
-            pkcs12_bin = p12.export(passphrase=passphrase)
+            return cert, pkey, ca_certs, {'cert': pem_bytes, 'key': pkey_bytes, 'ca_chain': ca_bytes}
+
+        except OpenSSLError as e:
+            print(f'{Fore.RED}OpenSSL Error loading key material for {host}: {e}')
+            return None
+        except Exception as e:
+            print(f'{Fore.RED}load_host_material() Error loading key material for {host}: {e}')
+            return None
+
+    @profiled('export_pkcs12')
+    def export_pkcs12(self, host, cert, pkey, ca_certs, passphrase, profile=DEFAULT_PKCS12_PROFILE, iterations=None):
+        """
+        Exports already loaded key material as PKCS12 and records the export time.
+        Returns the PKCS12 bytes, or None on failure.
+        """
+        friendly_name = f'{host}.pfx'
+        try:
+            kdf_iterations, mac_iterations = self.pkcs12_iterations(profile, iterations)
+            start = time.perf_counter()
+            pkcs12_bin = self._export_pkcs12(host, cert, pkey, ca_certs, self._passphrase_bytes(passphrase),
+                                             profile, iterations)
+            elapsed = time.perf_counter() - start
+            self.export_timings.append({'hostname': host, 'profile': profile, 'seconds': elapsed})
+            print(f'{Fore.CYAN} -- Exported {friendly_name} with profile {profile} '
+                  f'(KDF {kdf_iterations} / MAC {mac_iterations} iterations) in {elapsed * 1000:.1f} ms')
             return pkcs12_bin
 
         except OpenSSLError as e:
             print(f'{Fore.RED}OpenSSL Error creating PKCS12 file {friendly_name}: {e}')
             return None
         except Exception as e:
-            print(f'{Fore.RED}generate_pkcs12() Error creating PKCS12 file {friendly_name}: {e}')
+            print(f'{Fore.RED}export_pkcs12() Error creating PKCS12 file {friendly_name}: {e}')
             return None
 
+    def _passphrase_bytes(self, passphrase):
+        # The cryptography serializers only take bytes.  The menu passes a str.
+        return passphrase.encode('utf-8') if isinstance(passphrase, str) else passphrase
+
+    def pkcs12_iterations(self, profile, iterations=None):
+        """
+        Returns the (KDF, MAC) iteration counts a profile uses with an optional override.
+        """
+        settings = PKCS12_PROFILES[profile]
+        kdf = iterations or settings['iterations']
+        mac = (iterations or settings['mac_iterations']) if settings['mac_configurable'] else settings['mac_iterations']
+        return kdf, mac
+
+    def _export_pkcs12(self, host, cert, pkey, ca_certs, passphrase, profile, iterations=None):
+        """
+        Serializes the certificate, key and CA certificates using the named profile.
+        cert, pkey and ca_certs are pyOpenSSL objects.
+        """
+        settings = PKCS12_PROFILES[profile]
+        rounds, mac_rounds = self.pkcs12_iterations(profile, iterations)
+
+        if settings['key_cert_algorithm'] is None:
+            p12 = PKCS12()
+            p12.set_certificate(cert)
+            p12.set_privatekey(pkey)
+            if ca_certs:
+                p12.set_ca_certificates(ca_certs)
+            return p12.export(passphrase=passphrase, iter=rounds, maciter=mac_rounds)
+
+        encryption = (
+            PrivateFormat.PKCS12.encryption_builder()
+            .kdf_rounds(rounds)
+            .key_cert_algorithm(settings['key_cert_algorithm'])
+            .hmac_hash(settings['hmac_hash'])
+            .build(passphrase)
+        )
+        return pkcs12.serialize_key_and_certificates(
+            host.encode('utf-8'),
+            pkey.to_cryptography_key(),
+            cert.to_cryptography(),
+            [c.to_cryptography() for c in ca_certs] or None,
+            encryption
+        )
+
+    def report_export_timings(self):
+        """
+        Prints export count and timing per PKCS12 profile for this run.
+        """
+        if not self.export_timings:
+            return
+        print(f'\n{Fore.CYAN}{Style.BRIGHT}PKCS12 export timing by profile:')
+        print("{:<16}{:>8}{:>12}{:>12}{:>12}".format('profile', 'count', 'mean ms', 'min ms', 'max ms'))
+        for profile in PKCS12_PROFILES:
+            times = [t['seconds'] for t in self.export_timings if t['profile'] == profile]
+            if not times:
+                continue
+            print("{:<16}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}".format(
+                profile, len(times), sum(times) / len(times) * 1000, min(times) * 1000, max(times) * 1000))
+
+    def serialize_format(self, fmt, host, cert, pkey, ca_certs, passphrase, profile=DEFAULT_PKCS12_PROFILE, iterations=None):
+        """
+        Returns the bytes for one EXPORT_FORMATS entry from already loaded key material,
+        or None on failure.
+        """
+        if fmt == 'pkcs12':
+            if profile not in PKCS12_PROFILES:
+                print(f'{Fore.RED}Unknown PKCS12 profile "{profile}" for {host}. Available: {", ".join(PKCS12_PROFILES)}')
+                return None
+            return self.export_pkcs12(host, cert, pkey, ca_certs, passphrase, profile, iterations)
+        try:
+            crypto_cert = cert.to_cryptography()
+            if fmt == 'der':
+                return crypto_cert.public_bytes(Encoding.DER)
+            if fmt == 'fullchain':
+                if not ca_certs:
+                    print(f'{Fore.RED}No CA chain loaded for {host}, not writing a fullchain file with only the host certificate.')
+                    return None
+                return crypto_cert.public_bytes(Encoding.PEM) + b''.join(
+                    c.to_cryptography().public_bytes(Encoding.PEM) for c in ca_certs)
+            crypto_key = pkey.to_cryptography_key()
+            if fmt == 'pem':
+                return crypto_cert.public_bytes(Encoding.PEM) + crypto_key.private_bytes(
+                    Encoding.PEM, PrivateFormat.TraditionalOpenSSL, NoEncryption())
+            if fmt == 'pkcs8':
+                return crypto_key.private_bytes(
+                    Encoding.PEM, PrivateFormat.PKCS8, BestAvailableEncryption(self._passphrase_bytes(passphrase)))
+            print(f'{Fore.RED}Unknown export format "{fmt}" for {host}.')
+            return None
+        except Exception as e:
+            print(f'{Fore.RED}Error creating {fmt} output for {host}: {e}')
+            return None
+
+    def host_formats(self, cert_info, formats=DEFAULT_EXPORT_FORMATS):
+        """
+        Output formats for one cert list entry.  An "export_formats" key on the entry
+        (a list, or a comma separated string from the checklist) overrides the batch formats.
+        """
+        selected = cert_info.get("export_formats") or formats
+        if isinstance(selected, str):
+            selected = selected.split(',')
+        host_formats = []
+        for fmt in selected:
+            fmt = fmt.strip().lower()
+            if fmt not in EXPORT_FORMATS:
+                print(f'{Fore.YELLOW}Warning: Unknown export format "{fmt}" for {cert_info.get("hostname")}. Available: {", ".join(EXPORT_FORMATS)}')
+            elif fmt not in host_formats:
+                host_formats.append(fmt)
+        return host_formats
+
+    def set_output_name(self, host, fmt):
+        """
+        Generates a standardized output filename for an EXPORT_FORMATS entry.
+        """
+        if fmt == 'pkcs12':
+            return self.set_pfx_output_name(host)
+        return f'{host}_{self.today_date}{EXPORT_FORMATS[fmt]}'
+
+    @profiled('write_pks12')
     def write_pks12(self, pfx_output_path, pfx_data):
         """
         Writes the binary PKCS12 data to a file.
@@ -195,33 +443,35 @@ class PFXCreator:
             print(f'{Fore.RED}Error writing PKCS12 file {pfx_output_path}: {e}')
             return False
 
-    def validate_base64_cert(self, cert_filepath):
+    def validate_base64_cert(self, cert_filepath, pem_bytes=None):
         """
         Validates if a file contains a valid Base64 encoded X.509 certificate.
         Performs a basic header check and attempts to load the certificate.
+        Pass pem_bytes if the file has already been read.
+        Returns the loaded certificate, or None if it isn't valid.
         """
         try:
-            with open(cert_filepath, 'r', encoding='utf-8') as certfile:
-                content = certfile.read()
+            if pem_bytes is None:
+                with open(cert_filepath, 'rb') as certfile:
+                    pem_bytes = certfile.read()
 
             # Basic header check
-            if not content.strip().startswith('-----BEGIN CERTIFICATE-----'):
+            if not pem_bytes.strip().startswith(b'-----BEGIN CERTIFICATE-----'):
                 print(f'{Fore.RED}Certificate {cert_filepath} does not start with -----BEGIN CERTIFICATE-----')
-                return False
+                return None
 
             # More robust validation by attempting to load it
             try:
-                load_certificate(FILETYPE_PEM, content.encode('utf-8'))
-                return True
+                return load_certificate(FILETYPE_PEM, pem_bytes)
             except OpenSSLError:
                 print(f'{Fore.RED}Certificate {cert_filepath} is not a valid PEM certificate (OpenSSL error).')
-                return False
+                return None
         except FileNotFoundError:
             print(f'{Fore.RED}Error: Certificate file not found at {cert_filepath}')
-            return False
+            return None
         except Exception as e:
             print(f'{Fore.RED}Error validating base 64 x509 certificate {cert_filepath}: {e}')
-            return False
+            return None
 
     def validate_cert_and_key_files(self, host_dir, cert_filename, key_filename):
         """
@@ -269,75 +519,181 @@ class PFXCreator:
                 return f
             
 
-    def process_all_certs(self, passphrase):
+    def resolve_host_files(self, cert_info):
+        """
+        Works out the host directory and the full paths of the certificate, private key
+        and optional CA chain for one cert list entry.
+        Returns a dict with host, host_dir, cert, key and ca_chain, or None if the entry
+        is incomplete or required files are missing.
+        """
+        pkey_relative_path = cert_info.get("keyfile")
+        host = cert_info.get("hostname")
+        if not host:
+            print(f'{Fore.RED}Skipping entry due to missing "hostname" in: {cert_info}')
+            return None
+        # Manual append root ca cert.  The root CA file name comes from the home directory
+        cert_info["ca_chain_file"] = self.get_certfilename(self.HOME_DIR) # Get the root CA cert file name
+        # Construct the host-specific directory path
+        host_dir = os.path.join(self.HOME_DIR, host)
+        cert_filename = cert_info.get("certfile") # Expecting this in your JSON
+        # In case it's not populated in JSON
+        if cert_filename is None:
+            cert_filename = f'{host_dir}/certnew.cer'
+
+        ca_chain_relative_path = cert_info.get("ca_chain_file") # Optional CA chain file
+
+        if not all([pkey_relative_path, host, cert_filename]):
+            print(f'{Fore.RED}Skipping entry due to missing "keyfile", "hostname", or "certfile" in: {cert_info}')
+            return None
+
+        if not os.path.isdir(host_dir):
+            print(f'{Fore.RED}Host directory not found: {host_dir}. Skipping {host}.')
+            return None
+
+        # Validate and get full paths for the main certificate and key
+        files_present, cert_full_path, key_full_path = self.validate_cert_and_key_files(
+            host_dir, cert_filename, self.get_filename_from_path(pkey_relative_path)
+        )
+
+        ca_chain_full_path = None
+        if ca_chain_relative_path:
+            # A copy in the host directory wins, otherwise the one in the home directory is used
+            ca_chain_full_path = os.path.join(host_dir, ca_chain_relative_path)
+            if not os.path.exists(ca_chain_full_path):
+                ca_chain_full_path = os.path.join(self.HOME_DIR, ca_chain_relative_path)
+            # Check if the CA chain file actually exists
+            if not os.path.exists(ca_chain_full_path):
+                print(f'{Fore.YELLOW}Warning: CA chain file specified ("{ca_chain_relative_path}") but not found at {ca_chain_full_path} for {host}. PKCS12 will be created without a CA chain.')
+                ca_chain_full_path = None # Ensure it's None if not found
+            elif not os.path.isfile(ca_chain_full_path):
+                print(f'{Fore.YELLOW}Warning: CA chain path "{ca_chain_full_path}" is not a file. PKCS12 will be created without a CA chain.')
+                ca_chain_full_path = None
+
+        if not files_present:
+            print(f'{Fore.RED}Skipping PKCS12 generation for {host} due to missing required files.')
+            return None
+
+        return {
+            'host': host,
+            'host_dir': host_dir,
+            'cert': cert_full_path,
+            'key': key_full_path,
+            'ca_chain': ca_chain_full_path,
+        }
+
+    def host_pkcs12_settings(self, cert_info, profile=DEFAULT_PKCS12_PROFILE, iterations=None):
+        """
+        Returns the (profile, iterations) for one cert list entry.  "pkcs12_profile" and
+        "pkcs12_kdf_iterations" on the entry (from the checklist) win over the batch values.
+        """
+        host_profile = cert_info.get("pkcs12_profile") or profile
+        host_iterations = cert_info.get("pkcs12_kdf_iterations")
+        if host_iterations in (None, ''):
+            return host_profile, iterations
+        try:
+            return host_profile, int(host_iterations)
+        except (TypeError, ValueError):
+            print(f'{Fore.YELLOW}Warning: Invalid PKCS12 iterations "{host_iterations}" for {cert_info.get("hostname")}. Using the batch setting.')
+            return host_profile, iterations
+
+    def read_host_inputs(self, host_files):
+        """
+        Reads the certificate, key and CA chain named in host_files (from resolve_host_files)
+        into the same dict of bytes load_host_material returns, for input_hash().
+        """
+        return {key: self._read_file_as_bytes(host_files[key]) if host_files[key] else None
+                for key in ('cert', 'key', 'ca_chain')}
+
+    def input_hash(self, inputs, passphrase, profile, iterations=None, formats=DEFAULT_EXPORT_FORMATS):
+        """
+        HMAC-SHA256, keyed with the passphrase, over the certificate, key and CA chain
+        bytes in inputs plus the PKCS12 settings and output formats.  Stored in the
+        csr_list JSON so existing outputs can be checked against their inputs, including
+        the passphrase, without the passphrase itself being written down.
+        """
+        digest = hmac.new(self._passphrase_bytes(passphrase), f'{profile}:{iterations}:{",".join(formats)}'.encode('utf-8'), hashlib.sha256)
+        for key in ('cert', 'key', 'ca_chain'):
+            digest.update(key.encode('utf-8'))
+            digest.update(inputs.get(key) or b'')
+        return digest.hexdigest()
+
+    def process_cert(self, cert_info, passphrase, profile=DEFAULT_PKCS12_PROFILE, iterations=None,
+                     formats=DEFAULT_EXPORT_FORMATS):
+        """
+        Loads a single cert list entry's key, certificate and chain once and writes
+        each selected output format, recording the results on the entry.
+        Returns True if every selected output was written.
+        """
+        with PROFILER.host(cert_info.get("hostname")), PROFILER.span('process_cert'):
+            # Results from an earlier build must not outlive a failed rebuild, or the
+            # deployer would pick up a stale PFX
+            for key in PKCS12_RESULT_KEYS:
+                cert_info.pop(key, None)
+            host_files = self.resolve_host_files(cert_info)
+            if host_files is None:
+                return False
+
+            host = host_files['host']
+            print(f'\n{Fore.BLUE}{Style.BRIGHT}--- Processing host: {host} in directory: {host_files["host_dir"]} ---{Style.RESET_ALL}')
+
+            passphrase = self._passphrase_bytes(passphrase)
+            host_profile, host_iterations = self.host_pkcs12_settings(cert_info, profile, iterations)
+            host_formats = self.host_formats(cert_info, formats)
+            if not host_formats:
+                print(f'{Fore.RED}No valid export formats selected for {host}.')
+                return False
+
+            material = self.load_host_material(host, host_files['cert'], host_files['key'], host_files['ca_chain'])
+            if material is None:
+                print(f'{Fore.RED}Failed to generate PKCS12 data for {host}.')
+                return False
+            cert, pkey, ca_certs, inputs = material
+
+            outputs = {}
+            for fmt in host_formats:
+                output_path = os.path.join(host_files['host_dir'], self.set_output_name(host, fmt)) # Output to host's directory
+                data = self.serialize_format(fmt, host, cert, pkey, ca_certs, passphrase, host_profile, host_iterations)
+                if not data:
+                    print(f'{Fore.RED}Failed to generate {fmt} data for {host}.')
+                    continue
+                if self.write_pks12(output_path, data):
+                    outputs[fmt] = output_path
+
+            cert_info["outputs"] = outputs
+            if 'pkcs12' in outputs:
+                cert_info["pfxfile"] = outputs['pkcs12']
+                cert_info["pkcs12_profile_used"] = host_profile
+                cert_info["pkcs12_iterations"], cert_info["pkcs12_mac_iterations"] = self.pkcs12_iterations(
+                    host_profile, host_iterations)
+                cert_info["pkcs12_export_ms"] = round(self.export_timings[-1]['seconds'] * 1000, 1)
+            if len(outputs) != len(host_formats):
+                return False
+            cert_info["pkcs12_input_hash"] = self.input_hash(inputs, passphrase, host_profile, host_iterations, host_formats)
+            return True
+
+    def process_all_certs(self, passphrase, profile=DEFAULT_PKCS12_PROFILE, iterations=None,
+                          formats=DEFAULT_EXPORT_FORMATS):
         """
         Iterates through the loaded certificate list, processes each entry,
-        and generates the corresponding PKCS12 file.
+        and generates the corresponding PKCS12 file and any other selected formats.
+
+        profile is the batch PKCS12 profile, iterations the optional KDF iteration
+        override and formats the batch EXPORT_FORMATS. "pkcs12_profile",
+        "pkcs12_kdf_iterations" and "export_formats" keys on a cert list entry override
+        them for that host. The outputs, profile and iterations used and the export
+        time are recorded back into the csr_list JSON.
         """
         if not self.cert_list_data:
             print(f'{Fore.RED}There is no certificate list data to process. Exiting.')
             return
 
-        for cert_info in self.cert_list_data:
-            pkey_relative_path = cert_info.get("keyfile")
-            host = cert_info.get("hostname")
-            # Manual append root ca cert
-            cert_info["ca_chain_file"] = self.get_certfilename(self.HOME_DIR) # Get the root CA cert file name
-            # Construct the host-specific directory path
-            host_dir = os.path.join(self.HOME_DIR, host)
-            cert_filename = cert_info.get("certfile") # Expecting this in your JSON
-            # In case it's not populated in JSON
-            if cert_filename is None:
-                cert_filename = f'{host_dir}/certnew.cer'
-
-            ca_chain_relative_path = cert_info.get("ca_chain_file") # Optional CA chain file
-
-            if not all([pkey_relative_path, host, cert_filename]):
-                print(f'{Fore.RED}Skipping entry due to missing "keyfile", "hostname", or "certfile" in: {cert_info}')
-                continue
-
-            # Construct the host-specific directory path
-            host_dir = os.path.join(self.HOME_DIR, host)
-            if not os.path.isdir(host_dir):
-                print(f'{Fore.RED}Host directory not found: {host_dir}. Skipping {host}.')
-                continue
+        self.export_timings = []
+        passphrase = self._passphrase_bytes(passphrase)
 
-            print(f'\n{Fore.BLUE}{Style.BRIGHT}--- Processing host: {host} in directory: {host_dir} ---{Style.RESET_ALL}')
-
-            # Validate and get full paths for the main certificate and key
-            files_present, cert_full_path, key_full_path = self.validate_cert_and_key_files(
-                host_dir, cert_filename, self.get_filename_from_path(pkey_relative_path)
-            )
-
-            ca_chain_full_path = None
-            if ca_chain_relative_path:
-                ca_chain_full_path = os.path.join(host_dir, ca_chain_relative_path)
-                # Check if the CA chain file actually exists
-                if not os.path.exists(ca_chain_full_path):
-                    print(f'{Fore.YELLOW}Warning: CA chain file specified ("{ca_chain_relative_path}") but not found at {ca_chain_full_path} for {host}. PKCS12 will be created without a CA chain.')
-                    ca_chain_full_path = None # Ensure it's None if not found
-                elif not os.path.isfile(ca_chain_full_path):
-                    print(f'{Fore.YELLOW}Warning: CA chain path "{ca_chain_full_path}" is not a file. PKCS12 will be created without a CA chain.')
-                    ca_chain_full_path = None
-
-            if files_present:
-                pfx_output_filename = self.set_pfx_output_name(host)
-                pfx_output_path = os.path.join(host_dir, pfx_output_filename) # Output PFX to host's directory
-
-                pkcs12_data = self.generate_pkcs12(
-                    host,
-                    cert_full_path,
-                    key_full_path,
-                    passphrase,
-                    ca_chain_full_path # Pass the optional CA chain path
-                )
-
-                if pkcs12_data:
-                    self.write_pks12(pfx_output_path, pkcs12_data)
-                else:
-                    print(f'{Fore.RED}Failed to generate PKCS12 data for {host}.')
-            else:
-                print(f'{Fore.RED}Skipping PKCS12 generation for {host} due to missing required files.')
+        for cert_info in self.cert_list_data:
+            self.process_cert(cert_info, passphrase, profile, iterations, formats)
+        self.report_export_timings()
+        self.write_cert_list_file()
         print(f'\n{Fore.GREEN}{Style.BRIGHT}--- PKCS12 generation process complete ---{Style.RESET_ALL}')
 
 
@@ -365,8 +721,20 @@ if __name__ == '__main__':
                 print(f'{Fore.RED}Error getting passphrase: {e}. Exiting.')
                 exit(1)
 
-            # 4. Process all certificates and generate PKCS12 files
-            creator.process_all_certs(secure_passphrase)
+            # 4. Pick the batch PKCS12 profile. Hosts with "pkcs12_profile" in the JSON keep their own.
+            while True:
+                profile_input = input(f"{Fore.CYAN}PKCS12 profile ({', '.join(PKCS12_PROFILES)}) [{DEFAULT_PKCS12_PROFILE}]: {Style.RESET_ALL}")
+                batch_profile = profile_input.strip() or DEFAULT_PKCS12_PROFILE
+                if batch_profile in PKCS12_PROFILES:
+                    break
+                print(f'{Fore.RED}Unknown profile {batch_profile}.')
+            iterations_input = input(f"{Fore.CYAN}PKCS12 KDF iterations [profile default]: {Style.RESET_ALL}").strip()
+            batch_iterations = int(iterations_input) if iterations_input.isdigit() and int(iterations_input) > 0 else None
+            formats_input = input(f"{Fore.CYAN}Export formats, comma separated ({', '.join(EXPORT_FORMATS)}) [{','.join(DEFAULT_EXPORT_FORMATS)}]: {Style.RESET_ALL}")
+            batch_formats = formats_input.split(',') if formats_input.strip() else DEFAULT_EXPORT_FORMATS
+
+            # 5. Process all certificates and generate PKCS12 files and any other selected formats
+            creator.process_all_certs(secure_passphrase, profile=batch_profile, iterations=batch_iterations, formats=batch_formats)
         else:
             print(f'{Fore.RED}No certificate entries found in the JSON file. Nothing to process.')
     else:
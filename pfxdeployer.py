@@ -0,0 +1,262 @@
+'''
+
+Upload each host's PKCS12 file to its appliance after process_all_certs has run.
+
+Targets come from the checklist (hostname in column A, IP in column B, the IP is
+used when present) joined with the PKCS12 output recorded in the csr_list json.
+Uploads run concurrently over one pooled HTTPS connector, limited by a semaphore,
+with retries and exponential backoff.  The outcome for each host is written back
+to the csr_list json under "deployment".
+
+The login and upload paths are configurable to match your appliance API.  Use
+mockappliance.py to try a deployment offline.
+
+'''
+
+import argparse
+import asyncio
+import datetime
+import getpass
+import os
+import random
+import ssl
+import time
+
+import aiohttp
+from colorama import Fore, Style
+
+from pfxcreator import PFXCreator
+
+DEFAULT_LOGIN_PATH = '/token/v2/authenticate'
+DEFAULT_UPLOAD_PATH = '/v1/identity-certificate'
+# Responses worth retrying.  Anything else is treated as final.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DeploymentError(Exception):
+    # Raised for a failed request.  status is the HTTP status, or None for connection errors
+    def __init__(self, message, status=None, retry=True):
+        super().__init__(message)
+        self.status = status
+        self.retry = retry
+        self.attempts = None
+
+
+class PFXDeployer:
+    """
+    Uploads PKCS12 files to appliances over a pooled, concurrency limited async client.
+    """
+    def __init__(self, username, password, passphrase, concurrency=4, retries=3, backoff=1.0,
+                 timeout=60, scheme='https', port=443, verify_tls=True, ca_file=None,
+                 login_path=DEFAULT_LOGIN_PATH, upload_path=DEFAULT_UPLOAD_PATH, address_override=None):
+        self.username = username
+        self.password = password
+        self.passphrase = passphrase # PKCS12 passphrase sent with the upload (str)
+        self.concurrency = concurrency
+        self.retries = retries # Retries after the first attempt
+        self.backoff = backoff # Base delay in seconds, doubled on each retry
+        self.timeout = timeout
+        self.scheme = scheme
+        self.port = port
+        self.verify_tls = verify_tls
+        self.ca_file = ca_file
+        self.login_path = login_path
+        self.upload_path = upload_path
+        self.address_override = address_override # Send every upload here, e.g. 127.0.0.1 for the mock API
+
+    def build_targets(self, cert_list_data, host_list):
+        """
+        Joins the checklist host list with the csr_list entries.
+        Returns a list of dicts with hostname, address and cert_info.
+        """
+        ips = {h.get('hostname'): h.get('ip') for h in host_list}
+        targets = []
+        for cert_info in cert_list_data:
+            host = cert_info.get('hostname')
+            if host not in ips:
+                print(f'{Fore.YELLOW}Warning: {host} is not in the checklist, skipping deployment.')
+                continue
+            targets.append({
+                'hostname': host,
+                'address': self.address_override or ips[host] or host,
+                'cert_info': cert_info,
+            })
+        return targets
+
+    def _base_url(self, address):
+        return f'{self.scheme}://{address}:{self.port}'
+
+    def _ssl_context(self):
+        if self.scheme != 'https':
+            return None
+        if not self.verify_tls:
+            return False
+        return ssl.create_default_context(cafile=self.ca_file)
+
+    async def _with_retries(self, hostname, request):
+        """
+        Awaits request() until it succeeds, it fails with a final error or retries run out.
+        Returns (result, attempts).
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await request(), attempt
+            except (aiohttp.ClientSSLError, aiohttp.ServerFingerprintMismatch, ssl.SSLError) as e:
+                # Certificate and TLS failures won't fix themselves, so they aren't retried
+                error = DeploymentError(f'{type(e).__name__}: {e}', retry=False)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = DeploymentError(f'{type(e).__name__}: {e}')
+            except DeploymentError as e:
+                error = e
+            if not error.retry or attempt > self.retries:
+                error.attempts = attempt
+                raise error
+            delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            print(f'{Fore.YELLOW}{hostname}: attempt {attempt} failed ({error}), retrying in {delay:.1f}s')
+            await asyncio.sleep(delay)
+
+    async def _login(self, session, address):
+        async with session.post(self._base_url(address) + self.login_path,
+                                data={'username': self.username, 'password': self.password}) as resp:
+            if resp.status != 200:
+                raise DeploymentError(f'Login failed with HTTP {resp.status}', resp.status,
+                                      retry=resp.status in RETRY_STATUSES)
+            # Session cookies are passed on explicitly since appliances are often addressed by IP
+            return '; '.join(f'{k}={v.value}' for k, v in resp.cookies.items())
+
+    async def _upload(self, session, address, hostname, cookie, pfx_data):
+        # FormData can only be sent once, so it is rebuilt on every attempt
+        form = aiohttp.FormData()
+        form.add_field('hostname', hostname)
+        form.add_field('password', self.passphrase)
+        form.add_field('file', pfx_data, filename=f'{hostname}.pfx', content_type='application/x-pkcs12')
+        headers = {'Cookie': cookie} if cookie else {}
+        async with session.post(self._base_url(address) + self.upload_path, data=form, headers=headers) as resp:
+            if resp.status not in (200, 201, 204):
+                body = (await resp.text())[:200]
+                raise DeploymentError(f'Upload failed with HTTP {resp.status}: {body}', resp.status,
+                                      retry=resp.status in RETRY_STATUSES)
+            return resp.status
+
+    async def deploy_host(self, session, semaphore, target):
+        """
+        Logs in to one appliance and uploads its PKCS12 file.  Returns the outcome dict.
+        """
+        hostname = target['hostname']
+        address = target['address']
+        # The outputs of the latest build, so a failed rebuild never deploys an older PFX
+        pfxfile = (target['cert_info'].get('outputs') or {}).get('pkcs12')
+        outcome = {
+            'address': address,
+            'pfxfile': pfxfile,
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        if not pfxfile or not os.path.isfile(pfxfile):
+            outcome.update({'status': 'skipped', 'error': 'No PKCS12 file recorded for host'})
+            print(f'{Fore.YELLOW}{hostname}: no PKCS12 file to deploy, skipping.')
+            return outcome
+
+        try:
+            with open(pfxfile, 'rb') as f:
+                pfx_data = f.read()
+        except OSError as e:
+            # Only this host fails, the rest of the deployment carries on
+            outcome.update({'status': 'failed', 'error': f'Could not read {pfxfile}: {e}'})
+            print(f'{Fore.RED}{hostname}: could not read {pfxfile}: {e}')
+            return outcome
+
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                cookie, _ = await self._with_retries(hostname, lambda: self._login(session, address))
+                status, attempts = await self._with_retries(
+                    hostname, lambda: self._upload(session, address, hostname, cookie, pfx_data))
+                outcome.update({'status': 'ok', 'http_status': status, 'attempts': attempts})
+                print(f'{Fore.GREEN}{Style.BRIGHT}{hostname}: deployed {os.path.basename(pfxfile)} to {address}')
+            except DeploymentError as e:
+                outcome.update({'status': 'failed', 'http_status': e.status,
+                                'attempts': e.attempts, 'error': str(e)})
+                print(f'{Fore.RED}{hostname}: deployment to {address} failed: {e}')
+            outcome['seconds'] = round(time.perf_counter() - start, 3)
+        return outcome
+
+    async def deploy_all(self, targets):
+        """
+        Deploys every target over one pooled session.  Returns outcomes in target order.
+        """
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=self._ssl_context())
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            return await asyncio.gather(*(self.deploy_host(session, semaphore, t) for t in targets))
+
+    def deploy(self, cert_list_data, host_list):
+        """
+        Deploys every host, records each outcome on its csr_list entry under "deployment"
+        and returns the outcomes keyed by hostname.
+        """
+        targets = self.build_targets(cert_list_data, host_list)
+        if not targets:
+            print(f'{Fore.RED}No hosts to deploy.')
+            return {}
+        print(f'{Fore.CYAN}{Style.BRIGHT}Deploying {len(targets)} PKCS12 files, {self.concurrency} at a time.')
+        outcomes = asyncio.run(self.deploy_all(targets))
+        results = {}
+        for target, outcome in zip(targets, outcomes):
+            target['cert_info']['deployment'] = outcome
+            results[target['hostname']] = outcome
+        self.report(results)
+        return results
+
+    def report(self, results):
+        """
+        Prints a per-host summary of the deployment.
+        """
+        print(f'\n{Fore.CYAN}{Style.BRIGHT}Deployment results:')
+        print("{:<32}{:<18}{:<10}{:>10}{:>10}".format('host', 'address', 'status', 'attempts', 'seconds'))
+        for host, o in results.items():
+            print("{:<32}{:<18}{:<10}{:>10}{:>10}".format(
+                host, str(o['address']), o['status'], str(o.get('attempts') or '-'), str(o.get('seconds', '-'))))
+        ok = sum(1 for o in results.values() if o['status'] == 'ok')
+        print(f'{Fore.GREEN if ok == len(results) else Fore.YELLOW}{ok} of {len(results)} hosts deployed.')
+
+
+if __name__ == '__main__':
+    # Imported here so the deployer itself doesn't need openpyxl
+    from certmanager import CertManager
+
+    parser = argparse.ArgumentParser(description='Upload PKCS12 files to their appliances.')
+    parser.add_argument('--source', default=CertManager().SOURCE_XML_FILE, help='Checklist spreadsheet')
+    parser.add_argument('--username', default='admin', help='Appliance API user')
+    parser.add_argument('--concurrency', type=int, default=4, help='Uploads in flight at once')
+    parser.add_argument('--retries', type=int, default=3, help='Retries per request after the first attempt')
+    parser.add_argument('--backoff', type=float, default=1.0, help='Base retry delay in seconds')
+    parser.add_argument('--timeout', type=float, default=60, help='Per request timeout in seconds')
+    parser.add_argument('--scheme', default='https', choices=['https', 'http'])
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--insecure', action='store_true', help='Skip TLS certificate verification')
+    parser.add_argument('--ca-file', help='CA bundle used to verify the appliances')
+    parser.add_argument('--login-path', default=DEFAULT_LOGIN_PATH)
+    parser.add_argument('--upload-path', default=DEFAULT_UPLOAD_PATH)
+    parser.add_argument('--address-override', help='Send every upload to this address (e.g. 127.0.0.1 for mockappliance.py)')
+    args = parser.parse_args()
+
+    creator = PFXCreator()
+    if not creator.read_cert_list_file(creator.find_cert_list_file()):
+        print(f'{Fore.RED}No CSR list JSON file found. Run PKCS12 creation first.')
+        exit(1)
+    cm = CertManager()
+    cm.get_host_list(args.source)
+
+    api_password = getpass.getpass(f'{Fore.CYAN}Appliance password for {args.username}: {Style.RESET_ALL}')
+    passphrase = getpass.getpass(f'{Fore.CYAN}PKCS12 passphrase: {Style.RESET_ALL}')
+
+    deployer = PFXDeployer(args.username, api_password, passphrase, concurrency=args.concurrency,
+                           retries=args.retries, backoff=args.backoff, timeout=args.timeout,
+                           scheme=args.scheme, port=args.port, verify_tls=not args.insecure,
+                           ca_file=args.ca_file, login_path=args.login_path, upload_path=args.upload_path,
+                           address_override=args.address_override)
+    deployer.deploy(creator.cert_list_data, cm.HOST_LIST)
+    creator.write_cert_list_file()
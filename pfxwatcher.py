@@ -0,0 +1,266 @@
+'''
+
+Watch host directories (and an optional drop folder) for signed certificates and
+build PKCS12 files as they arrive, instead of waiting for every certnew.cer and
+running the whole batch.
+
+Uses inotify when the inotify_simple package is installed on Linux, otherwise
+polls the directories.  Hosts whose PFX is already up to date with its inputs
+(certificate, key, CA chain, PKCS12 profile, export formats and passphrase) are skipped.
+
+Drop folder: a signed certificate named <hostname>.cer, or any .cer whose CN
+matches a host, is copied to that host's directory as certnew.cer.
+
+'''
+
+import argparse
+import getpass
+import os
+import shutil
+import time
+
+from colorama import Fore, Style
+
+from OpenSSL.crypto import load_certificate, FILETYPE_PEM, Error as OpenSSLError
+from pfxcreator import PFXCreator, PKCS12_PROFILES, DEFAULT_PKCS12_PROFILE, EXPORT_FORMATS, DEFAULT_EXPORT_FORMATS
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class PFXWatcher:
+    """
+    Rebuilds PKCS12 files for individual hosts when their certificate inputs change.
+    """
+    def __init__(self, pfx_creator, passphrase, profile=DEFAULT_PKCS12_PROFILE, iterations=None,
+                 drop_dir=None, interval=2.0, use_inotify=True, formats=DEFAULT_EXPORT_FORMATS):
+        self.pfxc = pfx_creator
+        self.passphrase = passphrase
+        self.profile = profile
+        self.iterations = iterations
+        self.formats = formats
+        self.drop_dir = drop_dir
+        self.interval = interval # Polling interval / inotify read timeout in seconds
+        self.use_inotify = use_inotify and INotify is not None
+        self.hosts = {c.get('hostname'): c for c in self.pfxc.cert_list_data if c.get('hostname')}
+        self._snapshot = {}
+
+    def watched_dirs(self):
+        """
+        Host directories that exist, plus the drop folder if one is set.
+        """
+        dirs = [os.path.join(self.pfxc.HOME_DIR, h) for h in self.hosts]
+        if self.drop_dir:
+            dirs.append(self.drop_dir)
+        return [d for d in dirs if os.path.isdir(d)]
+
+    def is_up_to_date(self, cert_info, host_files):
+        """
+        True if every recorded output still exists and was built from the same inputs.
+        """
+        outputs = cert_info.get('pkcs12_input_hash') and cert_info.get('outputs')
+        if not outputs or not all(os.path.exists(p) for p in outputs.values()):
+            return False
+        host_profile, host_iterations = self.pfxc.host_pkcs12_settings(cert_info, self.profile, self.iterations)
+        host_formats = self.pfxc.host_formats(cert_info, self.formats)
+        return cert_info['pkcs12_input_hash'] == self.pfxc.input_hash(
+            self.pfxc.read_host_inputs(host_files), self.passphrase, host_profile, host_iterations, host_formats)
+
+    def build_host(self, host):
+        """
+        Builds the PFX for one host unless it is already up to date.
+        Returns True if a new PFX was written.
+        """
+        cert_info = self.hosts[host]
+        host_files = self.pfxc.resolve_host_files(cert_info)
+        if host_files is None:
+            return False
+        if self.is_up_to_date(cert_info, host_files):
+            print(f'{Fore.CYAN}{host} is up to date, skipping.')
+            return False
+        # Only the latest export's timing is needed here, so the list doesn't grow while the daemon runs
+        self.pfxc.export_timings = []
+        if self.pfxc.process_cert(cert_info, self.passphrase, self.profile, self.iterations, self.formats):
+            self.pfxc.write_cert_list_file()
+            return True
+        return False
+
+    def host_for_dropped_cert(self, path):
+        """
+        Matches a dropped certificate to a host by file name, then by subject CN.
+        """
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stem in self.hosts:
+            return stem
+        try:
+            with open(path, 'rb') as f:
+                cn = load_certificate(FILETYPE_PEM, f.read()).get_subject().CN
+        except (OSError, OpenSSLError):
+            return None
+        return cn if cn in self.hosts else None
+
+    def ingest_dropped_cert(self, path):
+        """
+        Copies a certificate from the drop folder into its host directory.
+        Returns the hostname, or None if it doesn't belong to a known host.
+        """
+        host = self.host_for_dropped_cert(path)
+        if host is None:
+            print(f'{Fore.YELLOW}Warning: {path} does not match any host in the certificate list.')
+            return None
+        cert_info = self.hosts[host]
+        host_dir = os.path.join(self.pfxc.HOME_DIR, host)
+        if not os.path.isdir(host_dir):
+            print(f'{Fore.RED}Host directory not found: {host_dir}. Leaving {path} in the drop folder.')
+            return None
+        dest = os.path.join(host_dir, cert_info.get('certfile') or 'certnew.cer')
+        if os.path.exists(dest) and self.pfxc._read_file_as_bytes(dest) == self.pfxc._read_file_as_bytes(path):
+            return host
+        try:
+            shutil.copyfile(path, dest)
+        except OSError as e:
+            print(f'{Fore.RED}Could not copy {path} to {dest}: {e}')
+            return None
+        print(f'{Fore.GREEN}Copied {path} to {dest}')
+        return host
+
+    def hosts_for_changes(self, changed_paths):
+        """
+        Maps changed file paths to the hosts that need their PFX rebuilt.
+        """
+        affected = set()
+        for path in changed_paths:
+            if not path.endswith(('.cer', '.crt', '.pem', '.key')):
+                continue
+            parent = os.path.dirname(path)
+            if self.drop_dir and os.path.abspath(parent) == os.path.abspath(self.drop_dir):
+                host = self.ingest_dropped_cert(path)
+            elif os.path.abspath(parent) == os.path.abspath(self.pfxc.HOME_DIR):
+                # The root CA in the home directory is used by every host without its own copy.
+                # Hosts whose inputs didn't change are skipped by build_host.
+                affected.update(self.hosts)
+                continue
+            else:
+                host = os.path.basename(parent)
+                # Our own .pem and .key outputs land in the host directory too
+                outputs = (self.hosts.get(host) or {}).get('outputs') or {}
+                if os.path.abspath(path) in {os.path.abspath(p) for p in outputs.values()}:
+                    continue
+            if host in self.hosts:
+                affected.add(host)
+        return affected
+
+    def _scan(self):
+        snapshot = {}
+        for d in self.watched_dirs() + [self.pfxc.HOME_DIR]:
+            for entry in os.scandir(d):
+                if entry.is_file():
+                    st = entry.stat()
+                    snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll_changes(self):
+        """
+        Waits one interval and returns the paths that were added or modified.
+        """
+        time.sleep(self.interval)
+        snapshot = self._scan()
+        changed = [p for p, sig in snapshot.items() if self._snapshot.get(p) != sig]
+        self._snapshot = snapshot
+        return changed
+
+    def _inotify_setup(self):
+        self._inotify = INotify()
+        self._wd_dirs = {}
+        # CREATE on the home directory wakes us up when a host directory is made
+        self._wd_dirs[self._inotify.add_watch(self.pfxc.HOME_DIR, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)] = self.pfxc.HOME_DIR
+        self._add_watches()
+
+    def _add_watches(self):
+        """
+        Watches directories that have appeared since the last cycle.
+        Returns the files already in them, which were written before the watch existed.
+        """
+        existing = {os.path.abspath(d) for d in self._wd_dirs.values()}
+        found = []
+        for d in self.watched_dirs():
+            if os.path.abspath(d) in existing:
+                continue
+            self._wd_dirs[self._inotify.add_watch(d, flags.CLOSE_WRITE | flags.MOVED_TO)] = d
+            found.extend(e.path for e in os.scandir(d) if e.is_file())
+        return found
+
+    def inotify_changes(self):
+        """
+        Blocks for up to one interval and returns the paths written or moved in,
+        plus the files in any directory that is now watched for the first time.
+        """
+        events = self._inotify.read(timeout=int(self.interval * 1000))
+        changed = [os.path.join(self._wd_dirs[e.wd], e.name) for e in events
+                   if e.wd in self._wd_dirs and not e.mask & flags.ISDIR]
+        return changed + self._add_watches()
+
+    def run(self, max_cycles=None):
+        """
+        Builds anything outstanding, then watches for changes until interrupted.
+        max_cycles limits the number of wait cycles (None runs forever).
+        """
+        print(f'{Fore.CYAN}{Style.BRIGHT}Watching {len(self.hosts)} hosts using {"inotify" if self.use_inotify else "polling"}.')
+        if self.drop_dir:
+            print(f'{Fore.CYAN}Drop folder: {self.drop_dir}')
+
+        # Catch up on certificates that arrived before we started
+        if self.drop_dir and os.path.isdir(self.drop_dir):
+            for entry in os.scandir(self.drop_dir):
+                if entry.is_file():
+                    self.hosts_for_changes([entry.path])
+        for host in self.hosts:
+            self.build_host(host)
+
+        if self.use_inotify:
+            self._inotify_setup()
+        else:
+            self._snapshot = self._scan()
+
+        cycles = 0
+        try:
+            while max_cycles is None or cycles < max_cycles:
+                cycles += 1
+                changed = self.inotify_changes() if self.use_inotify else self.poll_changes()
+                for host in sorted(self.hosts_for_changes(changed)):
+                    self.build_host(host)
+        except KeyboardInterrupt:
+            print(f'\n{Fore.CYAN}Stopped watching.')
+        finally:
+            if self.use_inotify:
+                self._inotify.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build PKCS12 files as signed certificates arrive.')
+    parser.add_argument('--drop', help='Drop folder for signed certificates')
+    parser.add_argument('--interval', type=float, default=2.0, help='Polling interval in seconds')
+    parser.add_argument('--profile', default=DEFAULT_PKCS12_PROFILE, choices=list(PKCS12_PROFILES),
+                        help='Batch PKCS12 profile')
+    parser.add_argument('--iterations', type=int, help='Override the profile KDF iteration count (and MAC count for the default profile)')
+    parser.add_argument('--formats', default=','.join(DEFAULT_EXPORT_FORMATS),
+                        help=f'Comma separated export formats ({", ".join(EXPORT_FORMATS)})')
+    parser.add_argument('--poll', action='store_true', help='Force polling even if inotify is available')
+    args = parser.parse_args()
+
+    creator = PFXCreator()
+    if not creator.read_cert_list_file(creator.find_cert_list_file()):
+        print(f'{Fore.RED}No CSR list JSON file found. Cannot watch for certificates.')
+        exit(1)
+
+    passphrase_input = getpass.getpass(f"{Fore.CYAN}Enter passphrase for PKCS12 files (will not be echoed): {Style.RESET_ALL}")
+    if not passphrase_input:
+        print(f'{Fore.RED}Passphrase cannot be empty. Exiting.')
+        exit(1)
+
+    watcher = PFXWatcher(creator, passphrase_input.encode('utf-8'), profile=args.profile,
+                         iterations=args.iterations, drop_dir=args.drop, interval=args.interval,
+                         use_inotify=not args.poll, formats=args.formats.split(','))
+    watcher.run()
@@ -0,0 +1,181 @@
+'''
+
+Opt-in timing spans for the CSR and PKCS12 hot paths.
+
+Methods decorated with @profiled record how long each call took and which host
+it was for while PROFILER is enabled.  When it is disabled the decorator only
+checks a flag.  Each run (generating CSRs, creating PKCS12 files) ends with a
+report of the slowest hosts and phases, and can also dump a cProfile stats file
+or a collapsed-stack file of the spans for flamegraph.pl / speedscope.
+
+    PROFILER.enable(dump='collapsed')
+    PROFILER.begin_run('pkcs12')
+    ...
+    PROFILER.end_run()
+
+'''
+
+import cProfile
+import contextlib
+import datetime
+import functools
+import os
+import time
+
+from colorama import Fore, Style
+
+DUMP_FORMATS = ('cprofile', 'collapsed')
+
+
+class Profiler:
+    """
+    Collects spans of (stack, host, seconds) for one run at a time.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.dump = None # None, 'cprofile' or 'collapsed'
+        self.output_dir = os.getcwd()
+        self.run_name = None
+        self.spans = [] # dicts with stack (tuple of phases), host, seconds, child_seconds
+        self._stack = []
+        self._host = None
+        self._cprofile = None
+
+    def enable(self, dump=None, output_dir=None):
+        if dump is not None and dump not in DUMP_FORMATS:
+            raise ValueError(f'Unknown profile dump format {dump}. Use one of {", ".join(DUMP_FORMATS)}')
+        self.enabled = True
+        self.dump = dump
+        self.output_dir = output_dir or os.getcwd()
+
+    def disable(self):
+        self.enabled = False
+
+    @contextlib.contextmanager
+    def host(self, hostname):
+        # Attribute spans inside this block to hostname
+        previous = self._host
+        self._host = hostname
+        try:
+            yield
+        finally:
+            self._host = previous
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        if not self.enabled:
+            yield
+            return
+        frame = {'phase': phase, 'child_seconds': 0.0}
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['child_seconds'] += seconds
+            self.spans.append({
+                'stack': tuple(f['phase'] for f in self._stack) + (phase,),
+                'host': self._host,
+                'seconds': seconds,
+                'child_seconds': frame['child_seconds'],
+            })
+
+    def begin_run(self, name):
+        """
+        Clears spans from the previous run and starts cProfile if it is being dumped.
+        """
+        if not self.enabled:
+            return
+        self.run_name = name
+        self.spans = []
+        self._stack = []
+        if self.dump == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def end_run(self, top=5):
+        """
+        Stops the run, writes any dump file and prints the report.
+        """
+        if not self.enabled:
+            return
+        path = None
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        base = os.path.join(self.output_dir, f'profile_{self.run_name}_{stamp}')
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            path = base + '.prof'
+            self._cprofile.dump_stats(path)
+            self._cprofile = None
+        elif self.dump == 'collapsed':
+            path = base + '.collapsed'
+            self.write_collapsed(path)
+        self.report(top)
+        if path:
+            print(f'{Fore.CYAN}Profile written to {path}')
+
+    def write_collapsed(self, path):
+        """
+        One line per host and span stack with self time in microseconds,
+        e.g. "host;process_cert;export_pkcs12 1234".
+        """
+        totals = {}
+        for s in self.spans:
+            key = ';'.join((s['host'] or 'no-host',) + s['stack'])
+            totals[key] = totals.get(key, 0.0) + s['seconds'] - s['child_seconds']
+        with open(path, 'w') as f:
+            for key, seconds in sorted(totals.items()):
+                f.write(f'{key} {max(int(seconds * 1000000), 0)}\n')
+
+    def report(self, top=5):
+        """
+        Prints the slowest hosts and phases of the run.
+        Phase times include nested phases, host times only count outermost spans.
+        """
+        if not self.spans:
+            return
+        phases = {}
+        hosts = {}
+        for s in self.spans:
+            phases.setdefault(s['stack'][-1], []).append(s['seconds'])
+            if len(s['stack']) == 1 and s['host']:
+                hosts.setdefault(s['host'], {})
+                hosts[s['host']][s['stack'][0]] = hosts[s['host']].get(s['stack'][0], 0.0) + s['seconds']
+
+        print(f'\n{Fore.CYAN}{Style.BRIGHT}Slowest phases ({self.run_name}):')
+        print("{:<36}{:>8}{:>12}{:>12}{:>12}".format('phase', 'count', 'total ms', 'mean ms', 'max ms'))
+        for phase, times in sorted(phases.items(), key=lambda p: sum(p[1]), reverse=True)[:top]:
+            print("{:<36}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}".format(
+                phase, len(times), sum(times) * 1000, sum(times) / len(times) * 1000, max(times) * 1000))
+
+        if hosts:
+            print(f'\n{Fore.CYAN}{Style.BRIGHT}Slowest hosts ({self.run_name}):')
+            print("{:<36}{:>12}  {}".format('host', 'total ms', 'slowest phase'))
+            for host, by_phase in sorted(hosts.items(), key=lambda h: sum(h[1].values()), reverse=True)[:top]:
+                # Slowest phase for the host, looking inside its outermost spans
+                nested = {}
+                for s in self.spans:
+                    if s['host'] == host and len(s['stack']) > 1:
+                        nested[s['stack'][-1]] = nested.get(s['stack'][-1], 0.0) + s['seconds']
+                slowest = max((nested or by_phase).items(), key=lambda p: p[1])
+                print("{:<36}{:>12.1f}  {} ({:.1f} ms)".format(
+                    host, sum(by_phase.values()) * 1000, slowest[0], slowest[1] * 1000))
+
+
+PROFILER = Profiler()
+
+
+def profiled(phase):
+    # Decorator that records a span for each call while PROFILER is enabled
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.span(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,349 @@
+'''
+
+End to end checks for the CSR -> PKCS12 -> deployment pipeline, the PFX
+watcher and the profiler.  Keys come from the fixture keys, so no RSA keys are generated, and
+uploads go to MockAppliance.
+
+'''
+
+import asyncio
+import datetime
+import json
+import os
+import socket
+import ssl
+import types
+
+import aiohttp
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+from csrcreator import CSRCreator, FixtureKeyProvider, KeyProvider
+from mockappliance import MockAppliance
+from pfxcreator import PFXCreator
+from pfxdeployer import PFXDeployer, DeploymentError
+from pfxwatcher import PFXWatcher
+from profiler import PROFILER
+
+HOSTS = [
+    {'hostname': 'smc1.example.com', 'ip': '10.0.0.10'},
+    {'hostname': 'fc1.example.com', 'ip': None},
+]
+PASSPHRASE = 'Password123'
+
+
+def make_ca():
+    key = FixtureKeyProvider().keys[0].to_cryptography_key()
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Test Root CA')])
+    now = datetime.datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(key, hashes.SHA256()))
+    return key, cert
+
+
+def sign_csr(csr_path, ca_key, ca_cert):
+    with open(csr_path, 'rb') as f:
+        csr = x509.load_pem_x509_csr(f.read())
+    now = datetime.datetime.utcnow()
+    return (x509.CertificateBuilder()
+            .subject_name(csr.subject).issuer_name(ca_cert.subject).public_key(csr.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(ca_key, hashes.SHA256()))
+
+
+def run_csrs(home, dry_run=False):
+    csrc = CSRCreator()
+    csrc.HOMEDIR = str(home)
+    csrc.set_key_provider(FixtureKeyProvider())
+    csrc.set_dry_run(dry_run)
+    csrc.set_host_list(HOSTS)
+    csrc.csr_hosts()
+    csrc.output_csr_list()
+    return csrc
+
+
+def write_signed_cert(home, hostname, ca_key, ca_cert, dest=None):
+    # Signs the host's CSR and writes it as certnew.cer, or to dest
+    csr_path = next((home / hostname).glob('*.csr'))
+    with open(dest or home / hostname / 'certnew.cer', 'wb') as f:
+        f.write(sign_csr(csr_path, ca_key, ca_cert).public_bytes(serialization.Encoding.PEM))
+
+
+def setup_hosts(home, sign=True):
+    # CSRs from the fixture keys, a test root CA in the home directory and, if sign, each host's certnew.cer
+    run_csrs(home)
+    ca_key, ca_cert = make_ca()
+    with open(home / 'root.cer', 'wb') as f:
+        f.write(ca_cert.public_bytes(serialization.Encoding.PEM))
+    if sign:
+        for h in HOSTS:
+            write_signed_cert(home, h['hostname'], ca_key, ca_cert)
+    pfxc = PFXCreator()
+    pfxc.HOME_DIR = str(home)
+    assert pfxc.read_cert_list_file(pfxc.find_cert_list_file())
+    return pfxc, ca_key, ca_cert
+
+
+def build_pfxs(home, profile='modern-aes256'):
+    # Signed hosts, then PKCS12 files for every host
+    pfxc, _, ca_cert = setup_hosts(home)
+    pfxc.process_all_certs(PASSPHRASE, profile=profile)
+    return pfxc, ca_cert
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_key_provider_is_abstract():
+    with pytest.raises(TypeError):
+        KeyProvider()
+
+
+def test_fixture_key_csr_to_pfx(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, ca_cert = build_pfxs(tmp_path)
+
+    provider = FixtureKeyProvider()
+    for h, cert_info in zip(HOSTS, pfxc.cert_list_data):
+        assert cert_info['pkcs12_profile_used'] == 'modern-aes256'
+        with open(cert_info['pfxfile'], 'rb') as f:
+            key, cert, cas = pkcs12.load_key_and_certificates(f.read(), PASSPHRASE.encode('utf-8'))
+        assert cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value == h['hostname']
+        assert [c.subject for c in cas] == [ca_cert.subject]
+        # The PFX holds the fixture key for the host
+        expected = provider.get_key(h['hostname']).to_cryptography_key()
+        assert key.private_numbers() == expected.private_numbers()
+
+
+def test_dry_run_writes_no_host_dirs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    csrc = run_csrs(tmp_path, dry_run=True)
+
+    assert sorted(os.listdir(tmp_path)) == [f'dryrun_csr_list_{datetime.date.today()}.json']
+    with open(tmp_path / f'dryrun_csr_list_{datetime.date.today()}.json') as f:
+        planned = json.load(f)
+    assert [e['hostname'] for e in planned] == [h['hostname'] for h in HOSTS]
+    assert all(e['dry_run'] for e in planned)
+    assert planned[0]['subjectAltName'] == 'DNS:smc1.example.com,IP:10.0.0.10'
+    assert csrc.CERT_LIST == planned
+
+
+def deploy_to_mock(deployer_args, pfxc, fail_first=0):
+    # Runs MockAppliance and a deployment in one event loop.  Returns (outcomes, mock).
+    port = free_port()
+    mock = MockAppliance(port=port, fail_first=fail_first)
+    deployer = PFXDeployer('admin', 'admin', PASSPHRASE, backoff=0.01, scheme='http', port=port,
+                           address_override='127.0.0.1', **deployer_args)
+
+    async def deploy():
+        await mock.start()
+        try:
+            return await deployer.deploy_all(deployer.build_targets(pfxc.cert_list_data, HOSTS))
+        finally:
+            await mock.stop()
+
+    return asyncio.run(deploy()), mock
+
+
+def test_deploy_retries_after_503(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, _ = build_pfxs(tmp_path)
+    outcomes, mock = deploy_to_mock({'retries': 2}, pfxc, fail_first=1)
+
+    assert [o['status'] for o in outcomes] == ['ok', 'ok']
+    # The first upload for each host got a 503 and the second was accepted
+    assert [o['attempts'] for o in outcomes] == [2, 2]
+    assert sorted(u['hostname'] for u in mock.uploads) == sorted(h['hostname'] for h in HOSTS)
+
+
+def test_failed_rebuild_is_not_deployed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, _ = build_pfxs(tmp_path)
+    cert_info = pfxc.cert_list_data[0]
+    old_pfx = cert_info['pfxfile']
+    cert_info['pkcs12_profile'] = 'no-such-profile'
+
+    assert not pfxc.process_cert(cert_info, PASSPHRASE)
+    assert os.path.isfile(old_pfx)
+    for key in ('pfxfile', 'pkcs12_profile_used', 'pkcs12_iterations', 'pkcs12_input_hash'):
+        assert key not in cert_info
+
+    outcomes, mock = deploy_to_mock({}, pfxc)
+    assert [o['status'] for o in outcomes] == ['skipped', 'ok']
+    assert [u['hostname'] for u in mock.uploads] == [HOSTS[1]['hostname']]
+
+
+def test_unreadable_pfx_fails_only_its_host(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, _ = build_pfxs(tmp_path)
+    unreadable = pfxc.cert_list_data[0]['pfxfile']
+
+    def open_pfx(path, *args, **kwargs):
+        if path == unreadable:
+            raise PermissionError(13, 'Permission denied', path)
+        return open(path, *args, **kwargs)
+    monkeypatch.setattr('pfxdeployer.open', open_pfx, raising=False)
+
+    outcomes, mock = deploy_to_mock({}, pfxc)
+    assert [o['status'] for o in outcomes] == ['failed', 'ok']
+    assert 'Permission denied' in outcomes[0]['error']
+    assert [u['hostname'] for u in mock.uploads] == [HOSTS[1]['hostname']]
+
+
+def test_deploy_does_not_retry_tls_errors():
+    deployer = PFXDeployer('admin', 'admin', PASSPHRASE, retries=3, backoff=0.01)
+    calls = []
+
+    async def request():
+        calls.append(1)
+        conn_key = types.SimpleNamespace(host='smc1.example.com', port=443, is_ssl=True, ssl=True)
+        raise aiohttp.ClientConnectorCertificateError(conn_key, ssl.SSLCertVerificationError('certificate verify failed'))
+
+    with pytest.raises(DeploymentError) as e:
+        asyncio.run(deployer._with_retries('smc1.example.com', request))
+    assert e.value.retry is False
+    assert e.value.attempts == 1
+    assert len(calls) == 1
+
+
+def test_watcher_skips_up_to_date_and_rebuilds_on_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, ca_key, ca_cert = setup_hosts(tmp_path)
+    host = HOSTS[0]['hostname']
+    watcher = PFXWatcher(pfxc, PASSPHRASE, use_inotify=False, formats=['pkcs12', 'pem', 'pkcs8'])
+
+    assert watcher.build_host(host)
+    first_hash = watcher.hosts[host]['pkcs12_input_hash']
+    assert PASSPHRASE not in json.dumps(watcher.hosts[host])
+    # Same inputs, nothing to do
+    assert not watcher.build_host(host)
+
+    # The watcher's own .pem and .key outputs don't count as changes, a new certificate does
+    outputs = list(watcher.hosts[host]['outputs'].values())
+    assert watcher.hosts_for_changes(outputs) == set()
+    write_signed_cert(tmp_path, host, ca_key, ca_cert)
+    assert watcher.hosts_for_changes([str(tmp_path / host / 'certnew.cer')]) == {host}
+    assert watcher.build_host(host)
+    assert watcher.hosts[host]['pkcs12_input_hash'] != first_hash
+
+    # A new passphrase changes the keyed input hash, so the host is rebuilt
+    watcher.passphrase = 'Another456'
+    assert watcher.build_host(host)
+    assert len(pfxc.export_timings) == 1
+
+
+def test_watcher_builds_dropped_certs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, ca_key, ca_cert = setup_hosts(tmp_path, sign=False)
+    drop = tmp_path / 'drop'
+    drop.mkdir()
+    named, by_cn = HOSTS[0]['hostname'], HOSTS[1]['hostname']
+    # Dropped before the watcher starts, matched by file name
+    write_signed_cert(tmp_path, named, ca_key, ca_cert, drop / f'{named}.cer')
+
+    def drop_during_poll(seconds):
+        # Dropped while polling, under a name that only matches by CN
+        if not (drop / 'signed.cer').exists():
+            write_signed_cert(tmp_path, by_cn, ca_key, ca_cert, drop / 'signed.cer')
+    monkeypatch.setattr('pfxwatcher.time.sleep', drop_during_poll)
+
+    watcher = PFXWatcher(pfxc, PASSPHRASE, drop_dir=str(drop), interval=0, use_inotify=False)
+    watcher.run(max_cycles=1)
+
+    for host in (named, by_cn):
+        assert (tmp_path / host / 'certnew.cer').exists()
+        assert os.path.isfile(watcher.hosts[host]['pfxfile'])
+
+
+def test_all_export_formats_from_one_load(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, _, ca_cert = setup_hosts(tmp_path)
+    cert_info = pfxc.cert_list_data[0]
+    assert pfxc.process_cert(cert_info, PASSPHRASE, formats=['pkcs12', 'pem', 'fullchain', 'der', 'pkcs8'])
+
+    outputs = cert_info['outputs']
+    assert sorted(outputs) == ['der', 'fullchain', 'pem', 'pkcs12', 'pkcs8']
+    with open(outputs['der'], 'rb') as f:
+        cert = x509.load_der_x509_certificate(f.read())
+    with open(outputs['fullchain'], 'rb') as f:
+        assert [c.subject for c in x509.load_pem_x509_certificates(f.read())] == [cert.subject, ca_cert.subject]
+    with open(outputs['pem'], 'rb') as f:
+        pem = f.read()
+    assert x509.load_pem_x509_certificate(pem) == cert
+    assert serialization.load_pem_private_key(pem, None).public_key().public_numbers() == cert.public_key().public_numbers()
+    with open(outputs['pkcs8'], 'rb') as f:
+        key = serialization.load_pem_private_key(f.read(), PASSPHRASE.encode('utf-8'))
+    assert key.public_key().public_numbers() == cert.public_key().public_numbers()
+
+
+def test_fullchain_without_chain_fails(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, _, _ = setup_hosts(tmp_path)
+    os.remove(tmp_path / 'root.cer')
+    cert_info = pfxc.cert_list_data[0]
+
+    assert not pfxc.process_cert(cert_info, PASSPHRASE, formats=['pkcs12', 'fullchain'])
+    assert list(cert_info['outputs']) == ['pkcs12']
+    assert 'pkcs12_input_hash' not in cert_info
+    assert not list((tmp_path / cert_info['hostname']).glob('*_fullchain.pem'))
+
+
+def test_input_hash_covers_the_loaded_bytes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pfxc, ca_key, ca_cert = setup_hosts(tmp_path)
+    host = HOSTS[0]['hostname']
+    watcher = PFXWatcher(pfxc, PASSPHRASE, use_inotify=False)
+    write_pks12 = pfxc.write_pks12
+
+    def replace_cert_mid_build(path, data):
+        # A new certificate lands after the old one was loaded but before the hash is recorded
+        write_signed_cert(tmp_path, host, ca_key, ca_cert)
+        return write_pks12(path, data)
+    monkeypatch.setattr(pfxc, 'write_pks12', replace_cert_mid_build)
+    assert watcher.build_host(host)
+    monkeypatch.setattr(pfxc, 'write_pks12', write_pks12)
+
+    host_files = pfxc.resolve_host_files(watcher.hosts[host])
+    assert not watcher.is_up_to_date(watcher.hosts[host], host_files)
+    assert watcher.build_host(host)
+    assert watcher.is_up_to_date(watcher.hosts[host], host_files)
+
+
+def test_profiler_collapsed_spans_per_host(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    PROFILER.enable(dump='collapsed', output_dir=str(tmp_path))
+    try:
+        PROFILER.begin_run('csr')
+        run_csrs(tmp_path)
+        spans = list(PROFILER.spans)
+        PROFILER.end_run()
+    finally:
+        PROFILER.disable()
+    report = capsys.readouterr().out
+
+    (collapsed,) = tmp_path.glob('profile_csr_*.collapsed')
+    lines = dict(line.rsplit(' ', 1) for line in collapsed.read_text().splitlines())
+    for h in HOSTS:
+        host = h['hostname']
+        stacks = {s for s in lines if s.startswith(host + ';')}
+        assert stacks == {f'{host};cert_request{tail}' for tail in
+                          ('', ';create_dir', ';generatekey', ';generatekey;keygen', ';create_csr')}
+        # Self times add up to the host's outermost span
+        total = sum(s['seconds'] for s in spans if s['host'] == host and s['stack'] == ('cert_request',))
+        assert abs(sum(int(lines[s]) for s in stacks) - total * 1000000) <= len(stacks)
+        # The report's per-host total is the same outermost span time
+        (row,) = [line for line in report.split('Slowest hosts (csr)')[1].splitlines() if line.startswith(host)]
+        assert row.split()[1] == f'{total * 1000:.1f}'
+    assert 'Slowest phases (csr)' in report
+    assert 'Slowest hosts (csr)' in report